@@ -0,0 +1,582 @@
+"""
+A local stand-in for the parts of the Airtable REST API that MottoBotto uses, for benchmarking and testing
+storage changes without a network connection.
+
+Run it standalone with `python fake_airtable.py --port 8080`, and point the bot at it with the
+`airtable.api_url` config option (e.g. `http://localhost:8080/v0`), or start it in-process with `FakeAirtable`.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from aiohttp import web
+
+log = logging.getLogger("FakeAirtable")
+
+MAX_RECORDS_PER_REQUEST = 10
+MAX_PAGE_SIZE = 100
+# Seconds of leeway given to requests arriving early, as a client can't control exactly when its requests arrive
+RATE_LIMIT_TOLERANCE = 0.05
+
+
+def error_response(status: int, error_type: str, message: str = "") -> web.Response:
+    return web.json_response({"error": {"type": error_type, "message": message}}, status=status)
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def is_truthy(value) -> bool:
+    return value not in (None, "", 0, False, [])
+
+
+def comparable(left, right) -> tuple:
+    # Airtable compares a number with text by reading the text as a number
+    if isinstance(left, (int, float)) and isinstance(right, str):
+        for number in (int, float):
+            try:
+                return left, number(right)
+            except ValueError:
+                pass
+        return str(left), right
+    if isinstance(right, (int, float)) and isinstance(left, str):
+        return tuple(reversed(comparable(right, left)))
+    if left is None:
+        left = "" if isinstance(right, str) else 0
+    if right is None:
+        right = "" if isinstance(left, str) else 0
+    if isinstance(left, list):
+        left = ", ".join(map(str, left))
+    if isinstance(right, list):
+        right = ", ".join(map(str, right))
+    return left, right
+
+
+def as_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(map(str, value))
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def sort_key(value) -> tuple:
+    # Blanks sort first, then numbers, then text
+    if not is_truthy(value) and value != 0:
+        return (0,)
+    if isinstance(value, (int, float)):
+        return 1, value
+    return 2, as_text(value)
+
+
+FUNCTIONS: dict[str, Callable[..., Any]] = {
+    "AND": lambda *args: all(is_truthy(a) for a in args),
+    "OR": lambda *args: any(is_truthy(a) for a in args),
+    "NOT": lambda value: not is_truthy(value),
+    "TRUE": lambda: True,
+    "FALSE": lambda: False,
+    "BLANK": lambda: None,
+    "LOWER": lambda value: as_text(value).lower(),
+    "UPPER": lambda value: as_text(value).upper(),
+    "TRIM": lambda value: as_text(value).strip(),
+    "LEN": lambda value: len(as_text(value)),
+    # Airtable uses RE2, whose character classes only match ASCII
+    "REGEX_MATCH": lambda value, pattern: bool(re.search(pattern, as_text(value), re.ASCII)),
+    "REGEX_REPLACE": lambda value, pattern, replacement: re.sub(
+        pattern, replacement.replace("\\", "\\\\"), as_text(value), flags=re.ASCII
+    ),
+    "DATETIME_PARSE": lambda value, *_: parse_datetime(value),
+    "IS_BEFORE": lambda left, right: bool(
+        parse_datetime(left) and parse_datetime(right) and parse_datetime(left) < parse_datetime(right)
+    ),
+    "IS_AFTER": lambda left, right: bool(
+        parse_datetime(left) and parse_datetime(right) and parse_datetime(left) > parse_datetime(right)
+    ),
+}
+
+COMPARISONS: dict[str, Callable[[Any, Any], bool]] = {
+    "=": lambda left, right: left == right,
+    "!=": lambda left, right: left != right,
+    "<": lambda left, right: left < right,
+    ">": lambda left, right: left > right,
+    "<=": lambda left, right: left <= right,
+    ">=": lambda left, right: left >= right,
+}
+
+TOKEN_REGEX = re.compile(
+    r"""\s*(?:
+        (?P<field>\{[^}]*\})
+        | (?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+        | (?P<number>\d+(?:\.\d+)?)
+        | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+        | (?P<operator><=|>=|!=|=|<|>|&)
+        | (?P<punctuation>[(),])
+    )""",
+    re.VERBOSE,
+)
+
+
+class FormulaError(ValueError):
+    pass
+
+
+class Formula:
+    """
+    Evaluates the subset of Airtable's formula language the bot uses in `filterByFormula`: field references,
+    string and number literals, comparisons, `&` concatenation and the functions in `FUNCTIONS`.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = self._tokenise(source)
+        self.position = 0
+        self.tree = self._expression()
+        if self.position != len(self.tokens):
+            raise FormulaError(f"Unexpected {self.tokens[self.position][1]!r} in formula {source!r}")
+
+    @staticmethod
+    def _tokenise(source: str) -> list[tuple[str, str]]:
+        tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            match = TOKEN_REGEX.match(source, position)
+            if not match:
+                raise FormulaError(f"Can't parse formula {source!r} at position {position}")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        return tokens
+
+    def _peek(self) -> Optional[tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self, value: Optional[str] = None) -> tuple[str, str]:
+        token = self._peek()
+        if not token or (value is not None and token[1] != value):
+            raise FormulaError(f"Expected {value or 'a value'!r} in formula {self.source!r}")
+        self.position += 1
+        return token
+
+    def _expression(self):
+        left = self._concatenation()
+        token = self._peek()
+        if token and token[0] == "operator" and token[1] in COMPARISONS:
+            self._take()
+            right = self._concatenation()
+            compare = COMPARISONS[token[1]]
+            return lambda record: compare(*comparable(left(record), right(record)))
+        return left
+
+    def _concatenation(self):
+        parts = [self._term()]
+        while (token := self._peek()) and token == ("operator", "&"):
+            self._take()
+            parts.append(self._term())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda record: "".join(as_text(part(record)) for part in parts)
+
+    def _term(self):
+        kind, value = self._take()
+        if kind == "field":
+            name = value[1:-1]
+            return lambda record: record.field(name)
+        if kind == "string":
+            text = self._unescape(value[1:-1])
+            return lambda record: text
+        if kind == "number":
+            number = float(value) if "." in value else int(value)
+            return lambda record: number
+        if (kind, value) == ("punctuation", "("):
+            inner = self._expression()
+            self._take(")")
+            return inner
+        if kind == "name":
+            return self._call(value.upper())
+        raise FormulaError(f"Unexpected {value!r} in formula {self.source!r}")
+
+    def _call(self, name: str):
+        self._take("(")
+        arguments = []
+        if self._peek() != ("punctuation", ")"):
+            arguments.append(self._expression())
+            while self._peek() == ("punctuation", ","):
+                self._take()
+                arguments.append(self._expression())
+        self._take(")")
+        if name == "LAST_MODIFIED_TIME":
+            return lambda record: record.modified_time
+        if name == "CREATED_TIME":
+            return lambda record: record.created_time
+        if name not in FUNCTIONS:
+            raise FormulaError(f"Unknown function {name} in formula {self.source!r}")
+        function = FUNCTIONS[name]
+        return lambda record: function(*(argument(record) for argument in arguments))
+
+    @staticmethod
+    def _unescape(text: str) -> str:
+        # Escaped quotes and backslashes become literal; other escapes (e.g. in regexes) are kept as written
+        return re.sub(r"\\(['\"\\])", r"\1", text)
+
+    def __call__(self, record: "FakeRecord") -> bool:
+        return is_truthy(self.tree(record))
+
+
+class FakeRecord:
+    def __init__(self, table: "FakeTable", record_id: str, fields: dict):
+        self.table = table
+        self.id = record_id
+        self.fields = dict(fields)
+        self.created_time = datetime.now(timezone.utc)
+        self.modified_time = self.created_time
+
+    def field(self, name: str):
+        if name in self.table.computed_fields:
+            return self.table.computed_fields[name](self)
+        return self.fields.get(name)
+
+    def to_json(self, fields: Optional[list[str]] = None) -> dict:
+        names = fields or [*self.fields, *self.table.computed_fields]
+        values = {name: self.field(name) for name in names}
+        return {
+            "id": self.id,
+            "createdTime": self.created_time.isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            # Airtable leaves out empty fields
+            "fields": {name: value for name, value in values.items() if is_truthy(value)},
+        }
+
+
+class FakeTable:
+    def __init__(self, name: str, computed_fields: Optional[dict[str, Callable[[FakeRecord], Any]]] = None):
+        self.name = name
+        self.records: dict[str, FakeRecord] = {}
+        self.computed_fields = computed_fields or {}
+        self.views: dict[str, Formula] = {}
+
+
+class FakeAirtable:
+    """
+    An in-memory Airtable base served over HTTP.
+
+    Supports listing (with `filterByFormula`, `view`, `sort`, `fields`, `pageSize` and `offset` pagination),
+    fetching a single record, creating and updating records singly or in batches, and deleting in batches.
+    Like the real API it allows `rate_limit_per_second` requests per second (returning 429 beyond that) and
+    at most 10 records per write. Every response is delayed by `latency` seconds, give or take `jitter`.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_per_second: Optional[int] = 5,
+        seed: Optional[int] = None,
+    ):
+        self.api_key = api_key
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_per_second = rate_limit_per_second
+        self.random = random.Random(seed)
+        self.tables: dict[str, FakeTable] = {}
+        self.request_counts: Counter = Counter()
+        self._tokens = float(rate_limit_per_second or 0)
+        self._tokens_updated = time.monotonic()
+        self._ids = itertools.count(1)
+        self._pages: dict[str, list[str]] = {}
+        self.runner: Optional[web.AppRunner] = None
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_get("/v0/{base}/{table}", self.list_records)
+        self.app.router.add_get("/v0/{base}/{table}/{record_id}", self.get_record)
+        self.app.router.add_post("/v0/{base}/{table}", self.create_records)
+        self.app.router.add_patch("/v0/{base}/{table}", self.update_records)
+        self.app.router.add_patch("/v0/{base}/{table}/{record_id}", self.update_record)
+        self.app.router.add_delete("/v0/{base}/{table}", self.delete_records)
+        self.app.router.add_delete("/v0/{base}/{table}/{record_id}", self.delete_record)
+
+    @classmethod
+    def with_motto_base(cls, **kwargs) -> "FakeAirtable":
+        """
+        A fake with the Motto and Member tables laid out as MottoBotto expects, including the computed
+        fields on Member that the leaderboard sorts by.
+        """
+        airtable = cls(**kwargs)
+        mottos = airtable.table("Motto")
+
+        def approved_mottos(link_field: str) -> Callable[[FakeRecord], list[str]]:
+            return lambda member: [
+                motto.id
+                for motto in mottos.records.values()
+                if member.id in (motto.fields.get(link_field) or [])
+                and motto.fields.get("Approved")
+                and motto.fields.get("Approved by Author")
+            ]
+
+        airtable.table(
+            "Member",
+            computed_fields={
+                "Mottos": approved_mottos("Member"),
+                "Motto Count": lambda member: len(approved_mottos("Member")(member)),
+                "Nominated Motto Count": lambda member: len(approved_mottos("Nominated By")(member)),
+                "Total Points": lambda member: len(approved_mottos("Member")(member)),
+            },
+        )
+        airtable.add_view("Motto", "Random", "AND({Motto}, {Approved}, {Approved by Author})")
+        return airtable
+
+    def table(self, name: str, computed_fields: Optional[dict] = None) -> FakeTable:
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, computed_fields)
+        elif computed_fields:
+            self.tables[name].computed_fields.update(computed_fields)
+        return self.tables[name]
+
+    def add_view(self, table: str, name: str, formula: str):
+        self.table(table).views[name] = Formula(formula)
+
+    def add_record(self, table: str, fields: dict) -> FakeRecord:
+        """
+        Insert a record directly, without going through HTTP (e.g. to seed data).
+        """
+        fake_table = self.table(table)
+        record = FakeRecord(fake_table, f"rec{next(self._ids):014d}", fields)
+        fake_table.records[record.id] = record
+        return record
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving. Returns the API URL to configure the bot with.
+        """
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        log.info(f"Fake Airtable listening on http://{host}:{port}/v0")
+        return f"http://{host}:{port}/v0"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.request_counts[request.method] += 1
+        rate_limited = not self._take_token()
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if self.api_key and request.headers.get("Authorization") != f"Bearer {self.api_key}":
+            return error_response(401, "AUTHENTICATION_REQUIRED", "Authentication required")
+        if rate_limited:
+            self.request_counts["rate_limited"] += 1
+            return error_response(429, "RATE_LIMIT_REACHED", "Rate limit exceeded. Please try again later")
+        try:
+            return await handler(request)
+        except FormulaError as error:
+            return error_response(422, "INVALID_FILTER_BY_FORMULA", str(error))
+
+    def _take_token(self) -> bool:
+        # Requests are counted when they arrive, with up to a second's worth allowed in a burst
+        if not self.rate_limit_per_second:
+            return True
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.rate_limit_per_second),
+            self._tokens + (now - self._tokens_updated) * self.rate_limit_per_second,
+        )
+        self._tokens_updated = now
+        if self._tokens < 1 - RATE_LIMIT_TOLERANCE * self.rate_limit_per_second:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _table(self, request: web.Request) -> FakeTable:
+        name = request.match_info["table"]
+        if name not in self.tables:
+            raise web.HTTPNotFound(
+                text='{"error": {"type": "TABLE_NOT_FOUND", "message": "Could not find table"}}',
+                content_type="application/json",
+            )
+        return self.tables[name]
+
+    @staticmethod
+    def _indexed_params(request: web.Request, prefix: str) -> list[str]:
+        # Both `fields[]=a&fields[]=b` and `fields[0]=a&fields[1]=b` are accepted
+        indexed = sorted(
+            (int(key[len(prefix) + 1 : -1]), value)
+            for key, value in request.query.items()
+            if re.fullmatch(re.escape(prefix) + r"\[\d+\]", key)
+        )
+        return [value for _, value in indexed] + request.query.getall(f"{prefix}[]", [])
+
+    async def list_records(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        offset = request.query.get("offset")
+        if offset:
+            if offset not in self._pages:
+                return error_response(422, "LIST_RECORDS_ITERATOR_NOT_AVAILABLE")
+            remaining = self._pages.pop(offset)
+        else:
+            records = list(table.records.values())
+            if view := request.query.get("view"):
+                if view not in table.views:
+                    return error_response(422, "VIEW_NAME_NOT_FOUND", f"Could not find view {view}")
+                records = [r for r in records if table.views[view](r)]
+            if formula := request.query.get("filterByFormula"):
+                predicate = Formula(formula)
+                records = [r for r in records if predicate(r)]
+            sort_index = 0
+            sorts = []
+            while field := request.query.get(f"sort[{sort_index}][field]"):
+                sorts.append((field, request.query.get(f"sort[{sort_index}][direction]", "asc")))
+                sort_index += 1
+            for field, direction in reversed(sorts):
+                records.sort(key=lambda r: sort_key(r.field(field)), reverse=direction == "desc")
+            remaining = [r.id for r in records]
+        try:
+            page_size = min(int(request.query.get("pageSize", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            return error_response(422, "INVALID_PAGE_SIZE")
+        page, remaining = remaining[:page_size], remaining[page_size:]
+        fields = self._indexed_params(request, "fields") or None
+        response = {
+            "records": [table.records[pk].to_json(fields) for pk in page if pk in table.records]
+        }
+        if remaining:
+            token = f"itr{next(self._ids):014d}"
+            self._pages[token] = remaining
+            response["offset"] = token
+        return web.json_response(response)
+
+    async def get_record(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        record = table.records.get(request.match_info["record_id"])
+        if not record:
+            return error_response(404, "NOT_FOUND")
+        return web.json_response(record.to_json())
+
+    async def _records_from_body(self, request: web.Request) -> tuple[list[dict], Optional[web.Response]]:
+        try:
+            body = await request.json()
+        except ValueError:
+            return [], error_response(422, "INVALID_REQUEST_BODY")
+        records = body.get("records")
+        if records is None:
+            return [], error_response(422, "INVALID_REQUEST_MISSING_FIELDS", "Missing records")
+        if not records or len(records) > MAX_RECORDS_PER_REQUEST:
+            return [], error_response(
+                422,
+                "INVALID_RECORDS",
+                f"You must provide an array of up to {MAX_RECORDS_PER_REQUEST} records",
+            )
+        return records, None
+
+    async def create_records(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        body = await request.json()
+        if "fields" in body:
+            record = self.add_record(table.name, body["fields"])
+            return web.json_response(record.to_json())
+        records, error = await self._records_from_body(request)
+        if error:
+            return error
+        created = [self.add_record(table.name, r.get("fields", {})) for r in records]
+        return web.json_response({"records": [r.to_json() for r in created]})
+
+    def _update(self, table: FakeTable, record_id: str, fields: dict) -> Optional[FakeRecord]:
+        record = table.records.get(record_id)
+        if record:
+            record.fields.update(fields)
+            record.modified_time = datetime.now(timezone.utc)
+        return record
+
+    async def update_records(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        records, error = await self._records_from_body(request)
+        if error:
+            return error
+        missing = [r.get("id") for r in records if r.get("id") not in table.records]
+        if missing:
+            return error_response(404, "NOT_FOUND", f"Could not find records {missing}")
+        updated = [self._update(table, r["id"], r.get("fields", {})) for r in records]
+        return web.json_response({"records": [r.to_json() for r in updated]})
+
+    async def update_record(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        body = await request.json()
+        record = self._update(table, request.match_info["record_id"], body.get("fields", {}))
+        if not record:
+            return error_response(404, "NOT_FOUND")
+        return web.json_response(record.to_json())
+
+    def _delete(self, table: FakeTable, record_ids: list[str]) -> web.Response:
+        if not record_ids or len(record_ids) > MAX_RECORDS_PER_REQUEST:
+            return error_response(
+                422, "INVALID_RECORDS", f"You must provide up to {MAX_RECORDS_PER_REQUEST} record IDs"
+            )
+        if missing := [pk for pk in record_ids if pk not in table.records]:
+            return error_response(404, "NOT_FOUND", f"Could not find records {missing}")
+        for pk in record_ids:
+            del table.records[pk]
+        return web.json_response({"records": [{"id": pk, "deleted": True} for pk in record_ids]})
+
+    async def delete_records(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        record_ids = request.query.getall("records[]", []) + request.query.getall("records", [])
+        return self._delete(table, record_ids)
+
+    async def delete_record(self, request: web.Request) -> web.Response:
+        table = self._table(request)
+        response = self._delete(table, [request.match_info["record_id"]])
+        if response.status == 200:
+            return web.json_response({"id": request.match_info["record_id"], "deleted": True})
+        return response
+
+
+async def serve(args: argparse.Namespace):
+    airtable = FakeAirtable.with_motto_base(
+        api_key=args.api_key,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_per_second=args.rate_limit or None,
+        seed=args.seed,
+    )
+    await airtable.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await airtable.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve a fake Airtable base for MottoBotto")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-key", help="Reject requests that don't use this key")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay each response by")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation in latency, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=5, help="Requests allowed per second (0 to disable)")
+    parser.add_argument("--seed", type=int, help="Seed for latency jitter")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,552 @@
+"""
+Benchmarks MottoBotto's event handlers end to end, with synthetic Discord messages and reactions, and reports
+latency percentiles, throughput and the storage and Discord calls each event costs.
+
+    python message_pipeline.py                       # against an in-memory SQLite store
+    python message_pipeline.py --storage-latency 50  # ...with every storage call taking 50ms
+    python message_pipeline.py --storage airtable    # against the fake Airtable API, rate limit and all
+    python message_pipeline.py --output before.json
+    python message_pipeline.py --compare before.json
+
+Runs are seeded and single-threaded, so results are comparable between commits on the same machine.
+"""
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+BOTTO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "botto")
+sys.path.insert(0, BOTTO_DIR)
+
+import discord  # noqa: E402
+
+from config import parse  # noqa: E402
+from fake_airtable import FakeAirtable  # noqa: E402
+from motto_storage import AirtableMottoStorage, MottoStorage  # noqa: E402
+from MottoBotto import MottoBotto  # noqa: E402
+from pending_messages import PendingMessages  # noqa: E402
+from reaction_sender import ReactionSender  # noqa: E402
+from regexes import compile_regexes  # noqa: E402
+from sqlite_storage import SQLiteMottoStorage  # noqa: E402
+
+log = logging.getLogger("MottoBotto").getChild("benchmark")
+
+BOT_ID = 800000000000000001
+GUILD_CHANNEL = "general"
+EXCLUDED_CHANNEL = "off-limits"
+
+ids = itertools.count(900000000000000000)
+
+
+class CountingStorage:
+    """
+    Wraps a MottoStorage, counting calls to its coroutine methods and optionally delaying each one to
+    simulate a remote store.
+    """
+
+    def __init__(self, storage: MottoStorage, latency: float = 0.0):
+        self.storage = storage
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if not inspect.iscoroutinefunction(attribute) or name in ("start", "close"):
+            return attribute
+
+        async def counted(*args, **kwargs):
+            self.calls[name] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return await attribute(*args, **kwargs)
+
+        return counted
+
+
+class DiscordCalls(Counter):
+    """
+    Counts calls made to the (fake) Discord API.
+    """
+
+    async def call(self, name: str, latency: float):
+        self[name] += 1
+        if latency:
+            await asyncio.sleep(latency)
+
+
+@dataclass(eq=False)
+class FakeUser:
+    id: int
+    name: str
+    nick: Optional[str] = None
+    bot: bool = False
+    dm_channel: Optional["FakeDMChannel"] = None
+    discord: Optional[DiscordCalls] = field(default=None, repr=False)
+    latency: float = 0.0
+
+    @property
+    def display_name(self) -> str:
+        return self.nick or self.name
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    async def create_dm(self) -> "FakeDMChannel":
+        await self.discord.call("create_dm", self.latency)
+        self.dm_channel = FakeDMChannel(self.discord, self, self.latency)
+        return self.dm_channel
+
+
+@dataclass(eq=False)
+class FakeGuild:
+    id: int
+    emojis: list = field(default_factory=list)
+
+
+class FakeMessageable:
+    def __init__(self, discord_calls: DiscordCalls, latency: float):
+        self.id = next(ids)
+        self.discord = discord_calls
+        self.latency = latency
+        self.messages: dict[int, "FakeMessage"] = {}
+
+    async def send(self, content=None, **kwargs) -> "FakeMessage":
+        await self.discord.call("send", self.latency)
+        return FakeMessage(self.discord, self.latency, content or "", BOT_USER, self)
+
+    async def trigger_typing(self):
+        await self.discord.call("trigger_typing", self.latency)
+
+    @asynccontextmanager
+    async def typing(self):
+        await self.discord.call("trigger_typing", self.latency)
+        yield
+
+    async def fetch_message(self, message_id: int) -> "FakeMessage":
+        await self.discord.call("fetch_message", self.latency)
+        return self.messages[message_id]
+
+
+class FakeTextChannel(FakeMessageable):
+    def __init__(self, discord_calls: DiscordCalls, latency: float, name: str, guild: FakeGuild):
+        super().__init__(discord_calls, latency)
+        self.name = name
+        self.guild = guild
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+
+class FakeDMChannel(FakeMessageable, discord.DMChannel):
+    # A DMChannel subclass, so the bot's `isinstance` checks treat it as one
+    def __init__(self, discord_calls: DiscordCalls, recipient: FakeUser, latency: float):
+        FakeMessageable.__init__(self, discord_calls, latency)
+        self.recipient = recipient
+
+    # The real implementations need a connection state
+    send = FakeMessageable.send
+    trigger_typing = FakeMessageable.trigger_typing
+    typing = FakeMessageable.typing
+    fetch_message = FakeMessageable.fetch_message
+
+
+@dataclass(eq=False)
+class FakeReaction:
+    emoji: str
+    me: bool
+
+
+@dataclass(eq=False)
+class FakeReference:
+    resolved: Optional["FakeMessage"]
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        discord_calls: DiscordCalls,
+        latency: float,
+        content: str,
+        author: FakeUser,
+        channel: FakeMessageable,
+        reference: Optional["FakeMessage"] = None,
+    ):
+        self.id = next(ids)
+        self.discord = discord_calls
+        self.latency = latency
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = getattr(channel, "guild", None)
+        self.reference = FakeReference(reference) if reference else None
+        self.mentions = [BOT_USER] if BOT_USER.mention in content.replace("<@!", "<@") else []
+        self.created_at = datetime.utcnow()
+        self.reactions: list[FakeReaction] = []
+        channel.messages[self.id] = self
+
+    async def add_reaction(self, emoji: str):
+        await self.discord.call("add_reaction", self.latency)
+        self.reactions.append(FakeReaction(emoji, me=True))
+
+    async def remove_reaction(self, emoji: str, member):
+        await self.discord.call("remove_reaction", self.latency)
+        self.reactions = [r for r in self.reactions if r.emoji != emoji]
+
+    async def reply(self, content=None, **kwargs) -> "FakeMessage":
+        await self.discord.call("reply", self.latency)
+        return FakeMessage(self.discord, self.latency, content or "", BOT_USER, self.channel, self)
+
+
+@dataclass
+class FakeEmoji:
+    name: str
+
+
+@dataclass
+class FakeReactionPayload:
+    emoji: FakeEmoji
+    member: FakeUser
+    user_id: int
+    channel_id: int
+    message_id: int
+
+
+BOT_USER = FakeUser(BOT_ID, "MottoBotto", bot=True)
+
+
+@dataclass
+class Scenario:
+    name: str
+    handler: str
+    prepare: Callable[[int], Awaitable[Callable[[], Awaitable[None]]]]
+
+
+class Pipeline:
+    """
+    A MottoBotto wired to fake Discord objects and a counting storage.
+    """
+
+    def __init__(self, bot: MottoBotto, storage: CountingStorage, discord_latency: float, seed: int):
+        self.bot = bot
+        self.storage = storage
+        self.discord = DiscordCalls()
+        self.discord_latency = discord_latency
+        self.random = random.Random(seed)
+        self.guild = FakeGuild(next(ids))
+        self.channels = {
+            name: FakeTextChannel(self.discord, discord_latency, name, self.guild)
+            for name in (GUILD_CHANNEL, EXCLUDED_CHANNEL)
+        }
+        self.users = [
+            FakeUser(next(ids), f"user{n}", discord=self.discord, latency=discord_latency) for n in range(50)
+        ]
+        BOT_USER.discord = self.discord
+
+        async def fetch_channel(channel_id: int):
+            await self.discord.call("fetch_channel", discord_latency)
+            return next(c for c in self.all_channels() if c.id == channel_id)
+
+        bot.fetch_channel = fetch_channel
+        bot.get_all_channels = lambda: iter(self.channels.values())
+        bot._connection.user = BOT_USER
+        bot.regexes = compile_regexes(BOT_ID, bot.config)
+        bot.resolve_channels()
+        # The fake Discord doesn't rate limit reactions
+        bot.reaction_sender = ReactionSender(bot, rate_per_second=float("inf"))
+        # Every fake message is sent after the bot started, as far as the pending message registry is concerned
+        bot.pending_messages = PendingMessages(
+            bot.config["pending_messages"]["cache_size"], since=discord.utils.snowflake_time(next(ids))
+        )
+
+    async def handle(self, event: Awaitable):
+        """
+        Run an event handler, and wait for the work it queued to finish.
+        """
+        await event
+        await self.bot.work_queue.join()
+
+    def all_channels(self):
+        yield from self.channels.values()
+        yield from (u.dm_channel for u in self.users if u.dm_channel)
+
+    def two_users(self) -> tuple[FakeUser, FakeUser]:
+        author, nominator = self.random.sample(self.users, 2)
+        return author, nominator
+
+    def message(self, content: str, author: FakeUser, channel=None, reference=None) -> FakeMessage:
+        channel = channel or self.channels[GUILD_CHANNEL]
+        return FakeMessage(self.discord, self.discord_latency, content, author, channel, reference)
+
+    def motto_text(self, iteration: int) -> str:
+        words = ["always", "never", "tea", "ship", "it", "the", "bugs", "are", "features", "friday"]
+        return " ".join(self.random.choices(words, k=6)) + f" number {iteration}"
+
+    def nomination(self, iteration: int, text: Optional[str] = None) -> tuple[FakeMessage, FakeMessage]:
+        author, nominator = self.two_users()
+        motto_message = self.message(text or self.motto_text(iteration), author)
+        return motto_message, self.message(f"<@!{BOT_ID}>", nominator, reference=motto_message)
+
+    def dm(self, content: str) -> FakeMessage:
+        user = self.random.choice(self.users)
+        if not user.dm_channel:
+            user.dm_channel = FakeDMChannel(self.discord, user, self.discord_latency)
+        return self.message(content, user, user.dm_channel)
+
+    def approval_payload(self, trigger_message: FakeMessage, emoji: str) -> FakeReactionPayload:
+        author = trigger_message.reference.resolved.author
+        return FakeReactionPayload(
+            emoji=FakeEmoji(emoji),
+            member=author,
+            user_id=author.id,
+            channel_id=trigger_message.channel.id,
+            message_id=trigger_message.id,
+        )
+
+    def scenarios(self) -> list[Scenario]:
+        bot = self.bot
+
+        async def chatter(i):
+            message = self.message("has anyone seen my keys?", self.random.choice(self.users))
+            return lambda: bot.on_message(message)
+
+        async def excluded_channel(i):
+            message = self.message(
+                f"<@!{BOT_ID}>", self.random.choice(self.users), self.channels[EXCLUDED_CHANNEL]
+            )
+            return lambda: bot.on_message(message)
+
+        async def nomination(i):
+            _, trigger = self.nomination(i)
+            return lambda: bot.on_message(trigger)
+
+        async def duplicate_nomination(i):
+            # The first nomination is approved, so the second is a duplicate
+            text = self.motto_text(i)
+            _, trigger = self.nomination(i, text)
+            await self.handle(bot.on_message(trigger))
+            await self.handle(bot.on_raw_reaction_add(self.approval_payload(trigger, bot.config["approval_reaction"])))
+            _, duplicate = self.nomination(i, text)
+            return lambda: bot.on_message(duplicate)
+
+        async def approval(i):
+            _, trigger = self.nomination(i)
+            await self.handle(bot.on_message(trigger))
+            payload = self.approval_payload(trigger, bot.config["approval_reaction"])
+            return lambda: bot.on_raw_reaction_add(payload)
+
+        async def unrelated_reaction(i):
+            _, trigger = self.nomination(i)
+            payload = self.approval_payload(trigger, "👍")
+            return lambda: bot.on_raw_reaction_add(payload)
+
+        async def stray_approval(i):
+            motto_message, _ = self.nomination(i)
+            payload = self.approval_payload(
+                self.message("so true", self.random.choice(self.users), reference=motto_message),
+                bot.config["approval_reaction"],
+            )
+            return lambda: bot.on_raw_reaction_add(payload)
+
+        def direct_message(content: str):
+            async def prepare(i):
+                message = self.dm(content)
+                return lambda: bot.on_message(message)
+
+            return prepare
+
+        return [
+            Scenario("chatter", "on_message", chatter),
+            Scenario("excluded_channel", "on_message", excluded_channel),
+            Scenario("nomination", "process_suggestion", nomination),
+            Scenario("duplicate_nomination", "process_suggestion", duplicate_nomination),
+            Scenario("approval", "on_raw_reaction_add", approval),
+            Scenario("unrelated_reaction", "on_raw_reaction_add", unrelated_reaction),
+            Scenario("stray_approval", "on_raw_reaction_add", stray_approval),
+            Scenario("dm_help", "process_dm", direct_message("!help")),
+            Scenario("dm_leaderboard", "process_dm", direct_message("!leaderboard")),
+            Scenario("dm_random", "process_dm", direct_message("!random")),
+            Scenario("dm_emoji", "process_dm", direct_message("!emoji 🚀")),
+        ]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_scenario(pipeline: Pipeline, scenario: Scenario, iterations: int, warmup: int) -> dict:
+    for i in range(warmup):
+        await pipeline.handle((await scenario.prepare(i))())
+
+    latencies = []
+    storage_calls = Counter()
+    discord_calls = Counter()
+    for i in range(iterations):
+        event = await scenario.prepare(warmup + i)
+        storage_before = Counter(pipeline.storage.calls)
+        discord_before = Counter(pipeline.discord)
+        started_at = time.perf_counter()
+        await pipeline.handle(event())
+        latencies.append(time.perf_counter() - started_at)
+        storage_calls.update(pipeline.storage.calls - storage_before)
+        discord_calls.update(pipeline.discord - discord_before)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "handler": scenario.handler,
+        "events": iterations,
+        "throughput_per_second": iterations / total if total else None,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "storage_calls_per_event": sum(storage_calls.values()) / iterations,
+        "storage_calls": {name: count / iterations for name, count in sorted(storage_calls.items())},
+        "discord_calls_per_event": sum(discord_calls.values()) / iterations,
+        "discord_calls": {name: count / iterations for name, count in sorted(discord_calls.items())},
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)
+            .decode("utf-8")
+            .strip()
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+async def build_storage(args: argparse.Namespace) -> tuple[MottoStorage, Optional[FakeAirtable]]:
+    if args.storage == "sqlite":
+        return SQLiteMottoStorage(":memory:", "benchmark"), None
+    airtable = FakeAirtable.with_motto_base(
+        latency=args.airtable_latency / 1000, rate_limit_per_second=args.airtable_rate_limit or None, seed=args.seed
+    )
+    api_url = await airtable.start()
+    storage = AirtableMottoStorage(
+        "appBenchmark", "key", "benchmark", "Random", api_url=api_url, rate_limit_per_second=args.airtable_rate_limit
+    )
+    return storage, airtable
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    config = parse({"channels": {"exclude": [EXCLUDED_CHANNEL]}, "id": "benchmark"})
+    storage, airtable = await build_storage(args)
+    counting_storage = CountingStorage(storage, args.storage_latency / 1000)
+    bot = MottoBotto(config, counting_storage)
+    pipeline = Pipeline(bot, counting_storage, args.discord_latency / 1000, args.seed)
+    await storage.start()
+    try:
+        # As the scheduler would on startup
+        for _, job, _ in storage.periodic_jobs():
+            await job()
+        results = {}
+        for scenario in pipeline.scenarios():
+            if args.scenario and scenario.name not in args.scenario:
+                continue
+            results[scenario.name] = await run_scenario(pipeline, scenario, args.iterations, args.warmup)
+            log.info(f"Finished {scenario.name}")
+    finally:
+        await bot.work_queue.close()
+        await storage.close()
+        if airtable:
+            await airtable.stop()
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "settings": {
+            key: getattr(args, key)
+            for key in (
+                "storage",
+                "iterations",
+                "warmup",
+                "seed",
+                "storage_latency",
+                "discord_latency",
+                "airtable_latency",
+                "airtable_rate_limit",
+            )
+        },
+        "scenarios": results,
+    }
+
+
+def change(new: Optional[float], old: Optional[float]) -> str:
+    if not new or not old:
+        return ""
+    return f" ({(new - old) / old:+.0%})"
+
+
+def print_report(report: dict, baseline: Optional[dict] = None):
+    print(f"Commit {report['commit']}, Python {report['python']}, settings {report['settings']}")
+    if baseline:
+        print(f"Compared with commit {baseline['commit']}, settings {baseline['settings']}")
+    header = f"{'scenario':<22}{'handler':<22}{'p50 ms':>16}{'p99 ms':>16}{'events/s':>18}{'storage':>14}{'discord':>14}"
+    print(header)
+    print("-" * len(header))
+    for name, result in report["scenarios"].items():
+        old = (baseline or {}).get("scenarios", {}).get(name, {})
+        print(
+            f"{name:<22}{result['handler']:<22}"
+            f"{result['p50_ms']:>9.3f}{change(result['p50_ms'], old.get('p50_ms')):>7}"
+            f"{result['p99_ms']:>9.3f}{change(result['p99_ms'], old.get('p99_ms')):>7}"
+            f"{result['throughput_per_second']:>11.1f}"
+            f"{change(result['throughput_per_second'], old.get('throughput_per_second')):>7}"
+            f"{result['storage_calls_per_event']:>14.2f}{result['discord_calls_per_event']:>14.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MottoBotto's message pipeline")
+    parser.add_argument("--storage", choices=["sqlite", "airtable"], default="sqlite")
+    parser.add_argument("--iterations", type=int, default=200, help="Timed events per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed events per scenario, run first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenario", action="append", help="Only run this scenario (can be repeated)")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="Milliseconds added to storage calls")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="Milliseconds added to Discord calls")
+    parser.add_argument("--airtable-latency", type=float, default=0.0, help="Fake Airtable response time, in ms")
+    parser.add_argument("--airtable-rate-limit", type=int, default=5, help="Fake Airtable requests per second")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with results previously written with --output")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # Some of the bot's loggers set their own level, so filter at the handler
+    handler = logging.StreamHandler()
+    handler.setLevel(args.log_level)
+    logging.basicConfig(level=args.log_level, handlers=[handler])
+    report = asyncio.run(benchmark(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import asyncio
 import logging
 import os
-import random
 import datetime
 import re
-from typing import Optional
+import time
+from typing import Awaitable, Callable, Optional
 
 from discord.utils import remove_markdown
 from emoji import UNICODE_EMOJI
@@ -13,18 +13,46 @@ import subprocess
 import discord
 from discord import Message, DeletedReferencedMessage, Guild
 
+import metrics
 import reactions
 from dm_helpers import get_dm_channel
-from regexes import SuggestionRegexes, compile_regexes
+from regexes import SuggestionRegexes, TriggerMatch, compile_regexes
 from message_checks import is_botto, is_dm
+from pending_messages import DELETE_CONFIRMATION, NOMINATION, PENDING_MESSAGE_LOOKUPS, PendingMessages
+from reaction_sender import Reaction, ReactionSender
+from scheduler import Scheduler
+from work_queue import WorkQueue, WorkQueueClosed
 
-from models import Motto
+from models import Motto, Member
 
 log = logging.getLogger("MottoBotto")
 log.setLevel(logging.DEBUG)
 
-
-CHANNEL_REGEX = re.compile(r"<#(\d+)>")
+HANDLER_SECONDS = metrics.histogram(
+    "mottobotto_handler_duration_seconds",
+    "Time taken to handle each Discord event, by handler and outcome",
+    labels=["handler", "outcome"],
+)
+DISCORD_REQUEST_SECONDS = metrics.histogram(
+    "mottobotto_discord_request_duration_seconds",
+    "Time taken by each request to the Discord API, by route and response status",
+    labels=["method", "route", "status"],
+)
+APPROVAL_STAGE_SECONDS = metrics.histogram(
+    "mottobotto_approval_stage_duration_seconds",
+    "Time taken by each stage of handling a motto approval, some of which run concurrently",
+    labels=["stage"],
+)
+MESSAGES_FILTERED = metrics.counter(
+    "mottobotto_messages_filtered_total",
+    "Channel messages dropped before suggestion processing, by the stage that dropped them",
+    labels=["stage"],
+)
+
+
+# Channel mentions and custom emojis, which clean_message turns into plain text
+MENTION_TOKEN_REGEX = re.compile(r"<#(\d+)>|<a?:\w+:\d+>")
+SNAIL_MESSAGES = ("i am 🐌", "i am snail")
 NUMBERS = [
     "zero",
     "one",
@@ -59,24 +87,114 @@ class MottoBotto(discord.Client):
 
         self.regexes: Optional[SuggestionRegexes] = None
 
+        # Channel IDs resolved from the names and IDs in config, None meaning every channel is included
+        self.included_channels: Optional[frozenset[int]] = None
+        self.excluded_channels: frozenset[int] = frozenset()
+
         self._cache = {
             "random": {
                 "users": {},
                 "last": None,
             },
+            # Replacements for channel mentions and, per guild, custom emojis, used by clean_message
+            "channels": {},
+            "emojis": {},
         }
 
+        self.pending_messages = PendingMessages(
+            self.config["pending_messages"]["cache_size"],
+            self.config["pending_messages"]["path"],
+            self.config["delete_unapproved_after_hours"],
+            delete_confirmation_ttl_hours=self.config["pending_messages"]["delete_confirmation_ttl_hours"],
+        )
+
+        self.reaction_sender = ReactionSender(
+            self,
+            self.config["reaction_rate_limit"]["rate_per_second"],
+            self.config["reaction_rate_limit"]["max_delay_seconds"],
+        )
+
+        self.work_queue = WorkQueue(
+            self.config["work_queue"]["workers"], self.config["work_queue"]["max_pending"]
+        )
+
+        self.scheduler = Scheduler()
+        self.scheduler.register(
+            "remove_unapproved_messages",
+            self.remove_unapproved_messages,
+            self.config["unapproved_cleanup_interval_minutes"] * 60,
+        )
+        self.scheduler.register(
+            "sweep_unapproved_messages",
+            self.sweep_unapproved_messages,
+            self.config["unapproved_storage_sweep_hours"] * 3600,
+        )
+        for name, job, interval in self.storage.periodic_jobs():
+            self.scheduler.register(name, job, interval, run_immediately=True)
+
+        self.metrics_server = (
+            metrics.MetricsServer(self.config["metrics"]["host"], self.config["metrics"]["port"])
+            if self.config["metrics"]["enabled"]
+            else None
+        )
+
         intents = discord.Intents(messages=True, guilds=True, reactions=True)
         super().__init__(intents=intents)
+        self._instrument_discord_requests()
+        self.resolve_channels()
+
+    def _instrument_discord_requests(self):
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            started_at = time.perf_counter()
+            status = "200"
+            try:
+                return await request(route, **kwargs)
+            except discord.HTTPException as error:
+                status = str(error.status)
+                raise
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                # Route paths are templates (e.g. /channels/{channel_id}/messages), so label cardinality stays low
+                DISCORD_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started_at, method=route.method, route=route.path, status=status
+                )
 
+        self.http.request = timed_request
+
+    async def start(self, *args, **kwargs):
+        if self.metrics_server:
+            await self.metrics_server.start()
+        await self.storage.start()
+        await self.pending_messages.start()
+        self.scheduler.start()
+        self.work_queue.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        # Finish handling the events we've already accepted while we can still talk to Discord
+        await self.work_queue.close(self.config["work_queue"]["drain_timeout_seconds"])
+        await super().close()
+        await self.scheduler.stop()
+        await self.storage.close()
+        await self.pending_messages.close()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
+    @metrics.timed(HANDLER_SECONDS, handler="on_connect")
     async def on_connect(self):
         if not self.regexes and self.user:
             self.regexes = compile_regexes(self.user.id, self.config)
 
+    @metrics.timed(HANDLER_SECONDS, handler="on_ready")
     async def on_ready(self):
         log.info("We have logged in as {0.user}".format(self))
         if not self.regexes:
             self.regexes = compile_regexes(self.user.id, self.config)
+        self.resolve_channels()
 
         await self.change_presence(
             activity=discord.Activity(
@@ -85,6 +203,46 @@ class MottoBotto(discord.Client):
             )
         )
 
+    async def on_guild_join(self, guild):
+        self.resolve_channels()
+        self._cache["channels"].clear()
+
+    async def on_guild_available(self, guild):
+        # Its channels may not have been known when channels were last resolved, e.g. before on_ready or an outage
+        self.resolve_channels()
+        self._cache["channels"].clear()
+
+    async def on_guild_channel_create(self, channel):
+        self.resolve_channels()
+        self._cache["channels"].clear()
+
+    async def on_guild_channel_update(self, before, after):
+        if before.name != after.name:
+            self.resolve_channels()
+            self._cache["channels"].clear()
+
+    async def on_guild_channel_delete(self, channel):
+        self._cache["channels"].clear()
+
+    async def on_guild_emojis_update(self, guild, before, after):
+        self._cache["emojis"].pop(guild.id, None)
+
+    def resolve_channels(self):
+        """
+        Resolve the channel names and IDs in config to sets of channel IDs, so filtering a message is a set lookup.
+        """
+
+        def resolve(names_or_ids: list[str]) -> frozenset[int]:
+            channel_ids = {int(c) for c in names_or_ids if c.isdigit()}
+            channel_ids.update(c.id for c in self.get_all_channels() if c.name in names_or_ids)
+            return frozenset(channel_ids)
+
+        include = self.config["channels"]["include"]
+        self.included_channels = resolve(include) if include else None
+        self.excluded_channels = resolve(self.config["channels"]["exclude"])
+        log.debug(f"Included channels: {self.included_channels}, excluded channels: {self.excluded_channels}")
+
+    @metrics.timed(HANDLER_SECONDS, handler="on_disconnect")
     async def on_disconnect(self):
         log.warning("Bot disconnected")
 
@@ -92,8 +250,18 @@ class MottoBotto(discord.Client):
         self, message: Message, reaction_type: str, default: str = None
     ):
         if reaction := self.config["reactions"].get(reaction_type, default):
-            await message.add_reaction(reaction)
+            await self.reaction_sender.send(message, reaction)
+
+    async def queue_work(self, key, kind: str, func: Callable[[], Awaitable[None]]):
+        """
+        Hand `func` to the work queue, to run after any work already queued for `key` (e.g. the same user).
+        """
+        try:
+            await self.work_queue.submit(key, kind, func)
+        except WorkQueueClosed:
+            log.warning(f"Dropped {kind} work for {key}, as the bot is shutting down")
 
+    @metrics.timed(HANDLER_SECONDS, handler="on_raw_reaction_add")
     async def on_raw_reaction_add(self, payload):
 
         if payload.emoji.name not in [
@@ -102,26 +270,53 @@ class MottoBotto(discord.Client):
         ]:
             return
 
+        if not self.pending_messages.get(payload.message_id) and self.pending_messages.covers(payload.message_id):
+            PENDING_MESSAGE_LOOKUPS.inc(result="ignored")
+            log.info(f"Ignoring reaction to message {payload.message_id}, which isn't pending.")
+            return
+
+        await self.queue_work(payload.user_id, "reaction", lambda: self.process_reaction(payload))
+
+    @metrics.timed(HANDLER_SECONDS, handler="process_reaction")
+    async def process_reaction(self, payload):
+
         log.info(f"Reaction received: {payload}")
         reactor = payload.member
 
-        channel = await self.fetch_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
+        pending = self.pending_messages.get(payload.message_id)
+        if pending and pending.usable:
+            PENDING_MESSAGE_LOOKUPS.inc(result="hit")
+            message = pending.message
+            channel = message.channel
+        elif not pending and self.pending_messages.covers(payload.message_id):
+            PENDING_MESSAGE_LOOKUPS.inc(result="ignored")
+            log.info(f"Ignoring message not pending approval.")
+            return
+        elif pending and pending.author_id != payload.user_id:
+            PENDING_MESSAGE_LOOKUPS.inc(result="ignored")
+            log.info(f"Ignoring reaction from somebody other than the motto author or requester.")
+            return
+        else:
+            # Sent before we started tracking pending messages, loaded from disk, or changed since, so ask Discord
+            PENDING_MESSAGE_LOOKUPS.inc(result="fetched")
+            channel = self.get_channel(payload.channel_id) or await self.fetch_channel(payload.channel_id)
+            message = await channel.fetch_message(payload.message_id)
+            pending = None
         log.info(f"Channel: {channel}")
         log.info(f"Message: {message}")
         log.info(f"Reactions: {message.reactions}")
 
         if payload.emoji.name == self.config["approval_reaction"]:
 
-            pending_reaction = any(
-                r.me and r.emoji == self.config["reactions"]["pending"]
-                for r in message.reactions
-            )
-            if not pending_reaction:
+            if pending:
+                if pending.kind != NOMINATION:
+                    log.info(f"Ignoring message not pending approval.")
+                    return
+            elif not self.is_pending(message):
                 log.info(f"Ignoring message not pending approval.")
                 return
 
-            motto_message: Message = message.reference.resolved
+            motto_message: Message = pending.referenced_message if pending else message.reference.resolved
 
             if isinstance(motto_message, DeletedReferencedMessage):
                 log.info(f"Ignoring approval for a message that's been deleted.")
@@ -133,16 +328,7 @@ class MottoBotto(discord.Client):
                 log.info(f"Ignoring approval from somebody other than motto author.")
                 return
 
-            motto = await self.storage.get_motto(message_id=motto_message.id)
-            if not motto:
-                log.info(f"Couldn't find matching message.")
-                return
-
-            trigger = None
-            for t in self.triggers:
-                if t.match(message.content):
-                    trigger = t
-                    break
+            trigger = self.regexes.triggers.match(message.content)
 
             if not trigger:
                 log.info(f"Ignoring approval on non-trigger message.")
@@ -169,20 +355,63 @@ class MottoBotto(discord.Client):
             else:
                 actual_motto = self.clean_message(motto_message.content, motto_message.guild)
 
-            if await self.is_repeat_message(motto_message, check_id=False):
-                await self.storage.delete_motto(pk=motto.primary_key)
-                await reactions.duplicate(self, message)
-                return
+            # Everything below is storage and Discord calls, run concurrently wherever they don't depend on each other
+            stages = metrics.Stages(APPROVAL_STAGE_SECONDS)
+            motto_task = asyncio.ensure_future(
+                stages.run("get_motto", self.storage.get_motto(message_id=motto_message.id))
+            )
+            repeat_task = asyncio.ensure_future(
+                stages.run("is_repeat_message", self.is_repeat_message(motto_message, check_id=False))
+            )
+            # Only look the members up for now; they're added below if they're missing, once the approval succeeds
+            members_task = asyncio.ensure_future(
+                stages.run(
+                    "get_members",
+                    asyncio.gather(
+                        self.storage.get_member(discord_id=reactor.id),
+                        self.storage.get_member(discord_id=message.author.id),
+                    ),
+                )
+            )
+
+            try:
+                motto, is_repeat = await asyncio.gather(motto_task, repeat_task)
+                if not motto:
+                    log.info(f"Couldn't find matching message.")
+                    return
 
-            motto.motto = actual_motto
-            motto.approved_by_author = True
-            await self.storage.save_motto(motto, fields=["motto", "approved_by_author"])
-            await reactions.stored(self, message, motto_message)
+                if is_repeat:
+                    await asyncio.gather(
+                        stages.run("delete_motto", self.storage.delete_motto(pk=motto.primary_key)),
+                        stages.run("reactions", reactions.duplicate(self, message)),
+                    )
+                    return
 
-            nominee = await self.storage.get_or_add_member(reactor)
-            nominator = await self.storage.get_or_add_member(message.author)
-            await self.storage.update_name(nominee, reactor)
-            await self.storage.update_name(nominator, message.author)
+                motto.motto = actual_motto
+                motto.approved_by_author = True
+                await stages.run("save_motto", self.storage.save_motto(motto, fields=["motto", "approved_by_author"]))
+
+                async def get_or_add(member: Optional[Member], discord_member: discord.abc.User) -> Member:
+                    return member or await self.storage.get_or_add_member(discord_member)
+
+                async def update_names():
+                    nominee, nominator = await members_task
+                    nominee, nominator = await asyncio.gather(
+                        get_or_add(nominee, reactor), get_or_add(nominator, message.author)
+                    )
+                    await asyncio.gather(
+                        self.storage.update_name(nominee, reactor),
+                        self.storage.update_name(nominator, message.author),
+                    )
+
+                await asyncio.gather(
+                    stages.run("reactions", reactions.stored(self, message, motto_message)),
+                    stages.run("update_names", update_names()),
+                )
+            finally:
+                # Don't leave lookups running unobserved when the approval stops early
+                await asyncio.gather(motto_task, repeat_task, members_task, return_exceptions=True)
+                log.info(f"Approval of {motto_message.id} took {stages}")
 
             return
 
@@ -196,69 +425,110 @@ class MottoBotto(discord.Client):
                 log.info(f"Ignoring reaction not in DM")
                 return
 
-            request = message.reference.resolved if message.reference else None
+            if pending:
+                request = pending.referenced_message if pending.kind == DELETE_CONFIRMATION else None
+            else:
+                request = message.reference.resolved if message.reference else None
             if not request or request.content.strip().lower() != "!delete":
                 log.info(f"Ignoring reaction to message not replying to !delete")
                 return
 
-            pending_reaction = any(
-                r.me and r.emoji == self.config["reactions"]["pending"]
-                for r in message.reactions
-            )
-            if not pending_reaction:
+            if not pending and not self.is_pending(message):
                 log.info(f"Ignoring message not pending approval.")
                 return
 
             async with channel.typing():
                 await self.storage.remove_all_data(payload.user_id)
 
-                await message.remove_reaction(
-                    self.config["reactions"]["pending"], self.user
+                await self.pending_messages.remove(message.id)
+                await self.reaction_sender.send(
+                    message,
+                    Reaction(self.config["reactions"]["pending"], remove=True),
+                    self.config["reactions"]["delete_confirmed"],
                 )
-                await message.add_reaction(self.config["reactions"]["delete_confirmed"])
                 await channel.send(
                     "All of your data has been removed. If you approve or nominate another motto in future, your user "
                     "data and any future approved mottos will be captured again. "
                 )
                 return
 
+    def is_pending(self, message: Message) -> bool:
+        return any(
+            r.me and r.emoji == self.config["reactions"]["pending"]
+            for r in message.reactions
+        )
+
+    async def on_raw_message_edit(self, payload):
+        # Embeds being added also arrive as edits, but don't change anything we rely on
+        if "content" in payload.data:
+            self.pending_messages.message_edited(payload.message_id)
+
+    async def on_raw_message_delete(self, payload):
+        await self.pending_messages.message_deleted(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            await self.pending_messages.message_deleted(message_id)
+
+    @metrics.timed(HANDLER_SECONDS, handler="on_message")
     async def on_message(self, message: Message):
 
         if is_dm(message):
-            await self.process_dm(message)
+            await self.queue_work(message.author.id, "dm", lambda: self.process_dm(message))
             return
 
-        channel_name = message.channel.name
+        channel_id = message.channel.id
 
         if (
-            self.config["channels"].get("include")
-            and channel_name not in self.config["channels"]["include"]
+            self.included_channels is not None
+            and channel_id not in self.included_channels
         ):
+            MESSAGES_FILTERED.inc(stage="channel")
             return
         else:
-            if channel_name in self.config["channels"].get("exclude", []):
+            if channel_id in self.excluded_channels:
+                MESSAGES_FILTERED.inc(stage="channel")
                 return
 
-        await self.process_suggestion(message)
-        await self.remove_unapproved_messages()
+        if not self.could_be_suggestion(message):
+            return
 
-    def clean_trigger_message(self, trigger, message) -> str:
-        return trigger.sub("", message).strip().strip("'\"”“").strip()
+        await self.queue_work(message.author.id, "suggestion", lambda: self.process_suggestion(message))
+
+    def could_be_suggestion(self, message: Message) -> bool:
+        """
+        Cheaply rule out messages process_suggestion would ignore, before any regexes are run over them.
+        """
+        if any(user.id == self.user.id for user in message.mentions):
+            # Tags, maintenance messages and mention triggers
+            return True
+        if self.regexes.triggers.could_match(message.content):
+            return True
+        if message.content.strip().lower() in SNAIL_MESSAGES:
+            return True
+        MESSAGES_FILTERED.inc(stage="prefilter")
+        return False
+
+    def clean_trigger_message(self, trigger: TriggerMatch, message) -> str:
+        return message[trigger.end:].strip().strip("'\"”“").strip()
 
     def clean_message(self, actual_motto: str, guild: Guild) -> str:
+        if "<" not in actual_motto:
+            return actual_motto
 
-        for channel_id in CHANNEL_REGEX.findall(actual_motto):
-            channel = self.get_channel(int(channel_id))
-            if not channel:
-                continue
-            actual_motto = actual_motto.replace(f"<#{channel_id}>", f"#{channel.name}")
+        channels = self._cache["channels"]
+        if (emojis := self._cache["emojis"].get(guild.id)) is None:
+            emojis = self._cache["emojis"][guild.id] = {str(x): f":{x.name}:" for x in guild.emojis}
 
-        server_emojis = {x.name: str(x) for x in guild.emojis}
-        for emoji in server_emojis:
-            if server_emojis[emoji] in actual_motto:
-                actual_motto = actual_motto.replace(server_emojis[emoji], f":{emoji}:")
+        def replace(token: re.Match) -> str:
+            if channel_id := token.group(1):
+                if (name := channels.get(channel_id)) is None:
+                    channel = self.get_channel(int(channel_id))
+                    name = channels[channel_id] = f"#{channel.name}" if channel else token.group()
+                return name
+            return emojis.get(token.group(), token.group())
 
-        return actual_motto
+        return MENTION_TOKEN_REGEX.sub(replace, actual_motto)
 
     async def is_repeat_message(self, message: Message, check_id=True) -> bool:
         matching_mottos = await self.storage.get_matching_mottos(
@@ -311,6 +581,7 @@ class MottoBotto(discord.Client):
             log.info(f"Nobody allowed to request a random motto until {allowed}")
             return False
 
+    @metrics.timed(HANDLER_SECONDS, handler="process_tag")
     async def process_tag(self, message: Message, content: list):
 
         log.info(f"Tagged message incoming: {message.content} / {content}")
@@ -346,27 +617,21 @@ class MottoBotto(discord.Client):
                 else:
                     await message.reply(f"{motto.motto}—{motto.member.display_name}")
 
-    @property
-    def triggers(self):
-        triggers = self.config["triggers"]["new_motto"]
-        if self.config["trigger_on_mention"]:
-            triggers = self.regexes.trigger + triggers
-        return triggers
-
+    @metrics.timed(HANDLER_SECONDS, handler="process_suggestion")
     async def process_suggestion(self, message: Message):
 
-        if (result := self.regexes.tag.findall(message.content)) and not message.reference:
+        if (
+            message.content.startswith("<@")
+            and (result := self.regexes.tag.findall(message.content))
+            and not message.reference
+        ):
             await self.process_tag(message, result)
             return
 
-        trigger = None
-        for t in self.triggers:
-            if t.match(message.content):
-                trigger = t
-                break
+        trigger = self.regexes.triggers.match(message.content)
 
         if not trigger:
-            if message.content.strip().lower() in ("i am 🐌", "i am snail"):
+            if message.content.strip().lower() in SNAIL_MESSAGES:
                 await reactions.snail(self, message)
             if str(message.author.id) in self.config["maintainer_ids"] and self.regexes.maintenance_up.match(
                     message.content):
@@ -430,6 +695,8 @@ class MottoBotto(discord.Client):
             )
             await self.storage.save_motto(motto)
             log.info(f"Added Motto from message ID {motto.message_id} to AirTable")
+            # Register it before anything else can fail, so it's expired if it's never approved
+            await self.pending_messages.add_nomination(message, motto_message, motto.primary_key)
 
             await reactions.pending(self, message, motto_message)
 
@@ -442,6 +709,7 @@ class MottoBotto(discord.Client):
             log.error("Failed to process suggestion", exc_info=True)
             raise e
 
+    @metrics.timed(HANDLER_SECONDS, handler="process_dm")
     async def process_dm(self, message: Message):
 
         if message.author == self.user:
@@ -616,7 +884,8 @@ You can DM me the following commands:
                 "yours that were nominated by other people. If so, react to this message with "
                 f"{self.config['confirm_delete_reaction']}. Otherwise, ignore this message. "
             )
-            await sent_message.add_reaction(self.config["reactions"]["pending"])
+            await self.reaction_sender.send(sent_message, self.config["reactions"]["pending"])
+            await self.pending_messages.add_delete_confirmation(sent_message, message)
             return
 
         if message_content.startswith("!emoji"):
@@ -647,8 +916,27 @@ You can DM me the following commands:
         await reactions.unknown_dm(self, message)
 
     async def remove_unapproved_messages(self):
-        # Don't do this for every message
-        if random.random() < 0.1:
-            await self.storage.remove_unapproved_messages(
-                self.config["delete_unapproved_after_hours"]
-            )
+        for pending in await self.pending_messages.expire():
+            if pending.kind != NOMINATION:
+                continue
+            try:
+                if pending.motto_pk:
+                    await self.storage.delete_motto(pk=pending.motto_pk)
+                elif motto := await self.storage.get_motto(message_id=pending.referenced_message_id):
+                    if not motto.approved_by_author:
+                        await self.storage.delete_motto(pk=motto.primary_key)
+            except Exception:
+                log.warning(f"Failed to remove unapproved motto for message {pending.message_id}", exc_info=True)
+
+        # Search storage when there may be unapproved mottos from before we tracked every nomination; otherwise
+        # that's left to the less frequent sweep
+        safe_period = self.config["delete_unapproved_after_hours"]
+        if not self.pending_messages.covers_since(datetime.datetime.utcnow() - datetime.timedelta(hours=safe_period)):
+            await self.storage.remove_unapproved_messages(safe_period)
+
+    async def sweep_unapproved_messages(self):
+        """
+        Remove expired unapproved mottos from storage, including any that never made it into the pending message
+        registry, e.g. because the bot stopped just after saving them.
+        """
+        await self.storage.remove_unapproved_messages(self.config["delete_unapproved_after_hours"])
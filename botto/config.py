@@ -35,6 +35,39 @@ def parse(config):
             "airtable_key": "",
             "airtable_base": "",
         },
+        "storage": {
+            "backend": "airtable",
+            "sqlite_path": "mottobotto.sqlite3",
+            "push_interval_seconds": 5,
+            "pull_interval_minutes": 5,
+            "full_pull_interval_minutes": 60,
+        },
+        "metrics": {
+            "enabled": False,
+            "host": "0.0.0.0",
+            "port": 9090,
+        },
+        "airtable": {
+            "connection_limit": 10,
+            "keepalive_timeout": 30.0,
+            "dns_cache_ttl": 300,
+            "rate_limit_per_second": 5,
+            "rate_limit_burst": 1,
+            "max_concurrent_requests": 5,
+            "retry_attempts": 4,
+            "retry_base_delay": 0.5,
+            "retry_max_delay": 10.0,
+            "retry_max_total_delay": 60.0,
+            "circuit_failure_threshold": 5,
+            "circuit_reset_seconds": 30.0,
+            "member_cache_size": 1024,
+            "member_cache_ttl": 3600,
+            "motto_index_refresh_minutes": 60,
+            "random_pool_refresh_minutes": 15,
+            "leaderboard_refresh_minutes": 10,
+            "member_write_delay_seconds": 2.0,
+            "api_url": "https://api.airtable.com/v0",
+        },
         "rules": {
             "matching": [
                 r"^.{5,240}$",  # Between 5 and 240 characters
@@ -104,6 +137,22 @@ def parse(config):
         "human_moderation_required": False,
         "leaderboard_link": None,
         "delete_unapproved_after_hours": 24,
+        "work_queue": {
+            "workers": 8,
+            "max_pending": 1000,
+            "drain_timeout_seconds": 30,
+        },
+        "reaction_rate_limit": {
+            "rate_per_second": 4,
+            "max_delay_seconds": 10,
+        },
+        "pending_messages": {
+            "cache_size": 5000,
+            "path": "mottobotto-pending.sqlite3",
+            "delete_confirmation_ttl_hours": 24,
+        },
+        "unapproved_cleanup_interval_minutes": 15,
+        "unapproved_storage_sweep_hours": 24,
         "trigger_on_mention": True,
         "confirm_delete_reaction": "🧨",
         "support_channel": None,
@@ -145,8 +194,24 @@ def parse(config):
     if token := os.getenv("MOTTOBOTTO_AIRTABLE_BASE"):
         defaults["authentication"]["airtable_base"] = token
 
+    if storage_backend := os.getenv("MOTTOBOTTO_STORAGE_BACKEND"):
+        defaults["storage"]["backend"] = storage_backend.lower()
+
+    if sqlite_path := os.getenv("MOTTOBOTTO_SQLITE_PATH"):
+        defaults["storage"]["sqlite_path"] = sqlite_path
+
+    if pending_messages_path := os.getenv("MOTTOBOTTO_PENDING_MESSAGES_PATH"):
+        defaults["pending_messages"]["path"] = pending_messages_path
+
+    if metrics_port := os.getenv("MOTTOBOTTO_METRICS_PORT"):
+        defaults["metrics"]["enabled"] = True
+        defaults["metrics"]["port"] = int(metrics_port)
+
     if channels := decode_base64_env("MOTTOBOTTO_CHANNELS"):
         defaults["channels"] = channels
+    # Channels can be given by name or ID, so compare them all as strings
+    for key in ("include", "exclude"):
+        defaults["channels"][key] = [str(channel) for channel in defaults["channels"].get(key, [])]
 
     if id := os.getenv("MOTTOBOTTO_ID"):
         defaults["id"] = id
@@ -0,0 +1,437 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+import metrics
+from models import Motto, Member, AirTableError, CircuitOpenError
+from motto_index import normalise_motto
+from motto_storage import AirtableMottoStorage
+from sqlite_storage import SCHEMA, SQLiteMottoStorage, format_date, new_primary_key
+from write_behind import is_rejection
+
+log = logging.getLogger("MottoBotto").getChild("hybrid_storage")
+
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    local_id TEXT NOT NULL,
+    fields TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS outbox_local_id ON outbox (table_name, local_id);
+
+CREATE TABLE IF NOT EXISTS airtable_ids (
+    table_name TEXT NOT NULL,
+    local_id TEXT NOT NULL,
+    airtable_id TEXT NOT NULL,
+    PRIMARY KEY (table_name, local_id),
+    UNIQUE (table_name, airtable_id)
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Fields only ever changed in the Airtable UI. These always take Airtable's value.
+AIRTABLE_OWNED_COLUMNS = {
+    "mottos": {"approved"},
+    "members": {"support"},
+}
+
+# Link fields, and the table the linked records are in
+LINK_FIELDS = {
+    "mottos": {"Member": "members", "Nominated By": "members"},
+    "members": {},
+}
+
+# Allow for clock differences between us and Airtable when pulling changes
+PULL_OVERLAP = timedelta(minutes=1)
+
+SYNC_OUTBOX_DEPTH = metrics.gauge(
+    "mottobotto_sync_outbox_depth", "Local changes waiting to be sent to Airtable"
+)
+SYNC_OUTBOX_OLDEST_SECONDS = metrics.gauge(
+    "mottobotto_sync_outbox_oldest_seconds",
+    "Age of the oldest local change waiting to be sent to Airtable",
+)
+SYNC_LAST_PULL_TIMESTAMP = metrics.gauge(
+    "mottobotto_sync_last_pull_timestamp_seconds",
+    "When changes were last successfully pulled from Airtable",
+)
+SYNC_PUSHED = metrics.counter(
+    "mottobotto_sync_pushed_total",
+    "Local changes sent to Airtable, by outcome",
+    labels=["table", "operation", "outcome"],
+)
+SYNC_PULLED = metrics.counter(
+    "mottobotto_sync_pulled_total",
+    "Airtable records applied to the local database, by action",
+    labels=["table", "action"],
+)
+
+
+def member_columns(record: dict) -> dict:
+    member = Member.from_airtable(record)
+    return {
+        "discord_id": member.discord_id,
+        "username": member.username,
+        "nickname": member.nickname,
+        "use_nickname": bool(member.use_nickname),
+        "emoji": member.emoji,
+        "support": bool(member.support),
+        "bot_id": member.bot_id,
+    }
+
+
+def motto_columns(record: dict) -> dict:
+    motto = Motto.from_airtable(record)
+    return {
+        "motto": motto.motto,
+        "normalised_motto": normalise_motto(motto.motto),
+        "message_id": motto.message_id,
+        "date": format_date(motto.date),
+        "member_id": motto.member,
+        "nominated_by_id": motto.nominated_by,
+        "approved_by_author": bool(motto.approved_by_author),
+        "approved": bool(motto.approved),
+        "bot_id": motto.bot_id,
+    }
+
+
+class HybridMottoStorage(SQLiteMottoStorage):
+    """
+    Stores mottos in a local SQLite database, and keeps an Airtable base in sync with it.
+
+    Every write is acknowledged as soon as it is committed locally, along with an entry in a durable outbox.
+    The outbox is replayed to Airtable in order, in batches, by `push`. `pull` brings in changes made in the
+    Airtable UI. Where both sides changed a record, local changes that haven't been sent yet win, except for
+    the fields only edited in Airtable (approval and support flags), where Airtable always wins.
+    """
+
+    schema = SCHEMA + SYNC_SCHEMA
+
+    def __init__(
+        self,
+        path: str,
+        bot_id: Optional[str],
+        airtable: AirtableMottoStorage,
+        push_interval_seconds: float = 5,
+        pull_interval_minutes: float = 5,
+        full_pull_interval_minutes: float = 60,
+    ):
+        super().__init__(path, bot_id)
+        self.airtable = airtable
+        self.push_interval_seconds = push_interval_seconds
+        self.pull_interval_minutes = pull_interval_minutes
+        self.full_pull_interval_minutes = full_pull_interval_minutes
+        self.urls = {"mottos": airtable.motto_url, "members": airtable.members_url}
+
+    def _record_change(
+        self,
+        connection: sqlite3.Connection,
+        table: str,
+        operation: str,
+        pk: str,
+        fields: Optional[dict] = None,
+    ):
+        connection.execute(
+            "INSERT INTO outbox (table_name, operation, local_id, fields, created_at) VALUES (?, ?, ?, ?, ?)",
+            (table, operation, pk, json.dumps(fields) if fields else None, time.time()),
+        )
+
+    async def start(self):
+        await super().start()
+        await self.airtable.start()
+
+    async def close(self):
+        if self.executor:
+            try:
+                await self.push()
+            except Exception:
+                log.error("Failed to push outstanding changes to Airtable", exc_info=True)
+        await self.airtable.close()
+        await super().close()
+
+    def periodic_jobs(self) -> list[tuple[str, Callable[[], Awaitable[None]], float]]:
+        return [
+            ("push_to_airtable", self.push, self.push_interval_seconds),
+            ("pull_from_airtable", self.pull, self.pull_interval_minutes * 60),
+        ]
+
+    async def _update_outbox_metrics(self):
+        row = await self._fetch_one("SELECT COUNT(*) AS depth, MIN(created_at) AS oldest FROM outbox")
+        SYNC_OUTBOX_DEPTH.set(row["depth"])
+        SYNC_OUTBOX_OLDEST_SECONDS.set(time.time() - row["oldest"] if row["oldest"] else 0)
+
+    async def _get_state(self, key: str) -> Optional[str]:
+        row = await self._fetch_one("SELECT value FROM sync_state WHERE key = ?", (key,))
+        return row["value"] if row else None
+
+    async def _set_state(self, key: str, value: str):
+        await self._write(
+            lambda connection: connection.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+        )
+
+    async def _airtable_ids(self, table: str, local_ids: list[str]) -> dict[str, str]:
+        placeholders = ", ".join("?" for _ in local_ids)
+        rows = await self._fetch_all(
+            f"SELECT local_id, airtable_id FROM airtable_ids WHERE table_name = ? AND local_id IN ({placeholders})",
+            (table, *local_ids),
+        )
+        return {row["local_id"]: row["airtable_id"] for row in rows}
+
+    async def _to_airtable_fields(self, table: str, fields: dict) -> dict:
+        fields = dict(fields)
+        for field, linked_table in LINK_FIELDS[table].items():
+            if linked_ids := [pk for pk in fields.get(field) or [] if pk]:
+                airtable_ids = await self._airtable_ids(linked_table, linked_ids)
+                missing = set(linked_ids) - set(airtable_ids)
+                if missing:
+                    log.warning(f"Dropping links to {linked_table} {missing}, which aren't in Airtable")
+                fields[field] = [airtable_ids[pk] for pk in linked_ids if pk in airtable_ids]
+            elif field in fields:
+                fields[field] = []
+        return fields
+
+    async def push(self):
+        """
+        Send queued local changes to Airtable, oldest first.
+        Stops at the first change that fails for a reason that might be temporary, so changes are never
+        applied out of order.
+        """
+        while True:
+            entries = await self._fetch_all("SELECT * FROM outbox ORDER BY id LIMIT 100")
+            if not entries:
+                break
+            # Consecutive changes of the same kind go in one request, up to Airtable's limit of 10
+            batches = []
+            for _, group in groupby(entries, key=lambda e: (e["table_name"], e["operation"])):
+                group = list(group)
+                batches.extend(group[offset : offset + 10] for offset in range(0, len(group), 10))
+            for batch in batches:
+                if not await self._push_batch(batch):
+                    await self._update_outbox_metrics()
+                    return
+        await self._update_outbox_metrics()
+
+    async def _push_batch(self, batch: list[sqlite3.Row]) -> bool:
+        table, operation = batch[0]["table_name"], batch[0]["operation"]
+        local_ids = [entry["local_id"] for entry in batch]
+        url = self.urls[table]
+        airtable_ids = await self._airtable_ids(table, local_ids)
+        new_mappings = []
+        removed_mappings = []
+        try:
+            if operation == "insert":
+                records = [
+                    {"fields": await self._to_airtable_fields(table, json.loads(entry["fields"]))}
+                    for entry in batch
+                ]
+                created = await self.airtable._modify_records(url, "post", records)
+                new_mappings = [
+                    (table, local_id, record["id"]) for local_id, record in zip(local_ids, created)
+                ]
+            elif operation == "update":
+                records = [
+                    {
+                        "id": airtable_ids[entry["local_id"]],
+                        "fields": await self._to_airtable_fields(table, json.loads(entry["fields"])),
+                    }
+                    for entry in batch
+                    if entry["local_id"] in airtable_ids
+                ]
+                if records:
+                    await self.airtable._modify_records(url, "patch", records)
+            elif operation == "delete":
+                to_delete = [airtable_ids[pk] for pk in local_ids if pk in airtable_ids]
+                if to_delete:
+                    await self.airtable._delete(url, to_delete)
+                removed_mappings = [(table, pk) for pk in local_ids]
+        except AirTableError as error:
+            if is_rejection(error) and len(batch) > 1:
+                # Airtable rejects the whole request if any one record is bad, so send the changes one at a time
+                # to find out which it was, rather than dropping the others with it
+                log.warning(
+                    f"Airtable rejected {operation} of {len(batch)} {table}, retrying them one at a time: {error}"
+                )
+                for entry in batch:
+                    if not await self._push_batch([entry]):
+                        return False
+                return True
+            if is_rejection(error):
+                # Airtable rejected the change itself, so sending it again won't help
+                log.error(f"Airtable rejected {operation} of {table} {local_ids}, dropping it: {error}")
+                SYNC_PUSHED.inc(len(batch), table=table, operation=operation, outcome="rejected")
+                await self._finish_batch(batch, [], [])
+                return True
+            return await self._retry_batch_later(batch, error)
+        except (CircuitOpenError, aiohttp.ClientError, asyncio.TimeoutError) as error:
+            return await self._retry_batch_later(batch, error)
+
+        missing = set(local_ids) - set(airtable_ids) if operation != "insert" else set()
+        if missing:
+            log.warning(f"Skipped {operation} of {table} {missing}, which were never sent to Airtable")
+        SYNC_PUSHED.inc(len(batch), table=table, operation=operation, outcome="sent")
+        await self._finish_batch(batch, new_mappings, removed_mappings)
+        return True
+
+    async def _retry_batch_later(self, batch: list[sqlite3.Row], error: Exception) -> bool:
+        log.warning(f"Failed to push {len(batch)} changes to Airtable, will retry: {error}")
+        SYNC_PUSHED.inc(
+            len(batch), table=batch[0]["table_name"], operation=batch[0]["operation"], outcome="failed"
+        )
+        entry_ids = [entry["id"] for entry in batch]
+        placeholders = ", ".join("?" for _ in entry_ids)
+        await self._write(
+            lambda connection: connection.execute(
+                f"UPDATE outbox SET attempts = attempts + 1 WHERE id IN ({placeholders})", entry_ids
+            )
+        )
+        return False
+
+    async def _finish_batch(
+        self,
+        batch: list[sqlite3.Row],
+        new_mappings: list[tuple[str, str, str]],
+        removed_mappings: list[tuple[str, str]],
+    ):
+        def finish(connection: sqlite3.Connection):
+            connection.executemany("DELETE FROM outbox WHERE id = ?", [(entry["id"],) for entry in batch])
+            connection.executemany(
+                "INSERT OR REPLACE INTO airtable_ids (table_name, local_id, airtable_id) VALUES (?, ?, ?)",
+                new_mappings,
+            )
+            connection.executemany(
+                "DELETE FROM airtable_ids WHERE table_name = ? AND local_id = ?", removed_mappings
+            )
+
+        await self._write(finish)
+
+    async def pull(self):
+        """
+        Apply changes made in Airtable to the local database.
+        Usually only records modified since the last pull are fetched. Periodically every record is fetched,
+        so that records deleted in Airtable are deleted locally too.
+        """
+        started_at = datetime.now(timezone.utc)
+        last_pull = await self._get_state("last_pull")
+        last_full_pull = await self._get_state("last_full_pull")
+        full = not last_full_pull or started_at - datetime.fromisoformat(last_full_pull) > timedelta(
+            minutes=self.full_pull_interval_minutes
+        )
+        filter_formula = None
+        if last_pull and not full:
+            since = datetime.fromisoformat(last_pull) - PULL_OVERLAP
+            filter_formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{since.isoformat()}'))"
+
+        # Members first, so mottos can be linked to them
+        for table in ("members", "mottos"):
+            records = [
+                record async for record in self.airtable._iterate(self.urls[table], filter_formula)
+            ]
+            await self._write(lambda connection: self._apply_records(connection, table, records, full))
+            log.info(f"Pulled {len(records)} {table} from Airtable ({'full' if full else 'incremental'})")
+
+        await self._set_state("last_pull", started_at.isoformat())
+        if full:
+            await self._set_state("last_full_pull", started_at.isoformat())
+        SYNC_LAST_PULL_TIMESTAMP.set(started_at.timestamp())
+        await self._update_outbox_metrics()
+
+    def _apply_records(self, connection: sqlite3.Connection, table: str, records: list[dict], full: bool):
+        pending = {
+            row["local_id"]
+            for row in connection.execute("SELECT DISTINCT local_id FROM outbox WHERE table_name = ?", (table,))
+        }
+        mappings = {
+            row["airtable_id"]: row["local_id"]
+            for row in connection.execute(
+                "SELECT local_id, airtable_id FROM airtable_ids WHERE table_name = ?", (table,)
+            )
+        }
+        member_ids = mappings if table == "members" else {
+            row["airtable_id"]: row["local_id"]
+            for row in connection.execute(
+                "SELECT local_id, airtable_id FROM airtable_ids WHERE table_name = 'members'"
+            )
+        }
+
+        for record in records:
+            if table == "members":
+                columns = member_columns(record)
+                natural_key = ("discord_id", columns["discord_id"])
+            else:
+                columns = motto_columns(record)
+                columns["member_id"] = member_ids.get(columns["member_id"])
+                columns["nominated_by_id"] = member_ids.get(columns["nominated_by_id"])
+                natural_key = ("message_id", columns["message_id"])
+
+            local_id = mappings.get(record["id"])
+            if not local_id and natural_key[1]:
+                # A record we created locally, whose insert hasn't been sent yet, or another copy of the bot created
+                existing = connection.execute(
+                    f"SELECT id FROM {table} WHERE {natural_key[0]} = ?", (natural_key[1],)
+                ).fetchone()
+                if existing:
+                    local_id = existing["id"]
+                    connection.execute(
+                        "DELETE FROM outbox WHERE table_name = ? AND local_id = ? AND operation = 'insert'",
+                        (table, local_id),
+                    )
+                    connection.execute(
+                        "INSERT OR REPLACE INTO airtable_ids (table_name, local_id, airtable_id) VALUES (?, ?, ?)",
+                        (table, local_id, record["id"]),
+                    )
+                    mappings[record["id"]] = local_id
+
+            if not local_id:
+                local_id = new_primary_key()
+                column_names = ", ".join(columns)
+                placeholders = ", ".join("?" for _ in columns)
+                connection.execute(
+                    f"INSERT INTO {table} (id, {column_names}) VALUES (?, {placeholders})",
+                    (local_id, *columns.values()),
+                )
+                connection.execute(
+                    "INSERT INTO airtable_ids (table_name, local_id, airtable_id) VALUES (?, ?, ?)",
+                    (table, local_id, record["id"]),
+                )
+                mappings[record["id"]] = local_id
+                SYNC_PULLED.inc(table=table, action="inserted")
+                continue
+
+            if local_id in pending:
+                # Unsent local changes win, apart from fields that are only edited in Airtable
+                columns = {k: v for k, v in columns.items() if k in AIRTABLE_OWNED_COLUMNS[table]}
+                SYNC_PULLED.inc(table=table, action="conflict")
+            else:
+                SYNC_PULLED.inc(table=table, action="updated")
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            connection.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", (*columns.values(), local_id))
+
+        if full:
+            seen = {record["id"] for record in records}
+            for airtable_id, local_id in mappings.items():
+                if airtable_id not in seen and local_id not in pending:
+                    connection.execute(f"DELETE FROM {table} WHERE id = ?", (local_id,))
+                    connection.execute(
+                        "DELETE FROM airtable_ids WHERE table_name = ? AND local_id = ?", (table, local_id)
+                    )
+                    SYNC_PULLED.inc(table=table, action="deleted")
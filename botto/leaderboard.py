@@ -0,0 +1,59 @@
+import heapq
+import logging
+from typing import Iterable, Optional
+
+from models import Member
+
+log = logging.getLogger("MottoBotto").getChild("leaderboard")
+
+
+def standing(member: Member) -> tuple:
+    # Matches the Airtable sort on "Total Points", using motto counts to break ties
+    return (
+        member.total_points or 0,
+        member.motto_count or 0,
+        member.nominated_motto_count or 0,
+    )
+
+
+class Leaderboard:
+    """
+    In-memory standings of every Member with at least one motto.
+    Counts and points are adjusted locally as mottos are approved or removed, and the whole board is periodically
+    replaced with Airtable's own figures.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.members: dict[str, Member] = {}
+
+    def replace(self, members: Iterable[Member]):
+        self.members = {m.primary_key: m for m in members if m.motto_count}
+        self.loaded = True
+
+    def refresh_member(self, member: Member):
+        """
+        Replace a Member with a fresher copy read from Airtable.
+        """
+        if member.motto_count:
+            self.members[member.primary_key] = member
+        else:
+            self.members.pop(member.primary_key, None)
+
+    def motto_approved(self, author: Optional[Member], nominator: Optional[Member]):
+        if author:
+            author = self.members.get(author.primary_key, author)
+            author.motto_count = (author.motto_count or 0) + 1
+            # Total Points is a formula in Airtable, so estimate it like the SQLite backend does (a point per
+            # approved motto) until the next reconcile brings in the real figure
+            author.total_points = (author.total_points or 0) + 1
+            self.members[author.primary_key] = author
+        if nominator:
+            nominator = self.members.get(nominator.primary_key, nominator)
+            nominator.nominated_motto_count = (nominator.nominated_motto_count or 0) + 1
+
+    def remove_member(self, pk: str):
+        self.members.pop(pk, None)
+
+    def top(self, count: int) -> list[Member]:
+        return heapq.nlargest(count, self.members.values(), key=standing)
@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Iterable, Iterator, Optional, TypeVar
+
+from aiohttp import web
+
+log = logging.getLogger("MottoBotto").getChild("metrics")
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{name}="{value}"'.format(
+            name=name,
+            value=str(value)
+            .replace("\\", r"\\")
+            .replace("\n", r"\n")
+            .replace('"', r"\""),
+        )
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labels}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labels, key))
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        for key, value in self._values.items():
+            yield self.name, self._labels(key), value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if key not in self._values:
+            self._values[key] = {
+                "buckets": [0] * len(self.buckets),
+                "sum": 0.0,
+                "count": 0,
+            }
+        observations = self._values[key]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                observations["buckets"][index] += 1
+        observations["sum"] += value
+        observations["count"] += 1
+
+    def value(self, **labels) -> Optional[dict]:
+        return self._values.get(self._key(labels))
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        for key, observations in self._values.items():
+            labels = self._labels(key)
+            for bound, count in zip(self.buckets, observations["buckets"]):
+                yield f"{self.name}_bucket", {
+                    **labels,
+                    "le": _format_value(bound),
+                }, count
+            yield f"{self.name}_sum", labels, observations["sum"]
+            yield f"{self.name}_count", labels, observations["count"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        if existing := self.metrics.get(name):
+            if not isinstance(existing, metric_class):
+                raise ValueError(f"Metric {name} is already registered as a {existing.type}")
+            return existing
+        metric = metric_class(name, *args, **kwargs)
+        self.metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, description, labels)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram, name, description, labels, buckets)
+
+    def render(self) -> str:
+        """
+        Render all registered metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def timed(histogram: Histogram, **labels) -> Callable:
+    """
+    Decorate a coroutine function to observe how long each call takes in `histogram`, labelled with
+    `labels` and the call's outcome ("success", "error" or "cancelled").
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            started_at = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "success"
+                return result
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started_at, outcome=outcome, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+class Stages:
+    """
+    Times the named stages of a single operation, observing each in `histogram` under a "stage" label and keeping
+    the durations so the whole operation can be logged. Stages may run concurrently.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.durations: dict[str, float] = {}
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        started_at = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.durations[stage] = time.perf_counter() - started_at
+            self.histogram.observe(self.durations[stage], stage=stage)
+
+    def __str__(self) -> str:
+        return ", ".join(f"{stage} {duration * 1000:.1f}ms" for stage, duration in self.durations.items())
+
+
+class MetricsServer:
+    """
+    Serves the registry over HTTP at `/metrics`, for Prometheus to scrape.
+    """
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def start(self):
+        if self.runner:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        log.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
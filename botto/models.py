@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Optional, Union
 
 from dateutil import parser
 from yarl import URL
@@ -91,6 +91,7 @@ class Member(Model):
         "motto_count",
         "nominated_motto_count",
         "total_score",
+        "total_points",
         "bot_id",
         "mottos",
     ]
@@ -109,10 +110,24 @@ class Member(Model):
             motto_count=fields.get("Motto Count", 0),
             nominated_motto_count=fields.get("Nominated Motto Count", 0),
             total_score=fields.get("Total Score", 0),
+            total_points=fields.get("Total Points", 0),
             bot_id=fields.get("Bot ID", None),
             mottos=fields.get("Mottos", []),
         )
 
+    # Fields the bot writes, and the attributes they correspond to
+    editable_fields = {
+        "Username": "username",
+        "Nickname": "nickname",
+        "Use Nickname": "use_nickname",
+        "Emoji": "emoji",
+    }
+
+    def apply_airtable_fields(self, fields: dict):
+        for field, value in fields.items():
+            if attr := self.editable_fields.get(field):
+                setattr(self, attr, value)
+
     @property
     def display_name(self):
         emoji = ""
@@ -124,10 +139,17 @@ class Member(Model):
 
 class AirTableError(Exception):
     def __init__(
-        self, url: URL, response_dict: Union[dict, str], *args: object
+        self,
+        url: URL,
+        response_dict: Union[dict, str],
+        *args: object,
+        status: Optional[int] = None,
+        retry_after: Optional[float] = None,
     ) -> None:
         error_dict: dict = response_dict["error"]
         self.url = url
+        self.status = status
+        self.retry_after = retry_after
         if type(error_dict) is dict:
             self.error_type = error_dict.get("type")
             self.error_message = error_dict.get("message")
@@ -137,8 +159,9 @@ class AirTableError(Exception):
         super().__init__(*args)
 
     def __repr__(self) -> str:
-        return "{class_name}(type:{error_type}, message:'{error_message}', url:{url})".format(
+        return "{class_name}(status:{status}, type:{error_type}, message:'{error_message}', url:{url})".format(
             class_name=self.__class__,
+            status=self.status,
             error_type=self.error_type,
             error_message=self.error_message,
             url=self.url,
@@ -148,3 +171,19 @@ class AirTableError(Exception):
         return "Error from AirTable operation of type '{error_type}', with message:'{error_message}'. Request URL: {url}".format(
             error_type=self.error_type, error_message=self.error_message, url=self.url
         )
+
+
+class CircuitOpenError(Exception):
+    def __str__(self) -> str:
+        return "Airtable requests are being shed after repeated failures"
+
+
+class DeleteFailedError(Exception):
+    def __init__(self, failed_ids: list[str], *args: object) -> None:
+        self.failed_ids = failed_ids
+        super().__init__(*args)
+
+    def __str__(self) -> str:
+        return "Failed to delete records: {failed_ids}".format(
+            failed_ids=", ".join(self.failed_ids)
+        )
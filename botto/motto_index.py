@@ -0,0 +1,106 @@
+import logging
+import re
+from typing import Iterable, Optional
+
+log = logging.getLogger("MottoBotto").getChild("motto_index")
+
+# Airtable formulas use RE2, whose character classes only match ASCII
+PUNCTUATION_REGEX = re.compile(r"[^\w ]+", re.ASCII)
+WHITESPACE_REGEX = re.compile(r"\s+", re.ASCII)
+
+
+def normalise_motto(motto: Optional[str]) -> str:
+    """
+    Normalise motto text for duplicate detection.
+    Mirrors the Airtable formula
+    `REGEX_REPLACE(REGEX_REPLACE(LOWER(TRIM(motto)), '[^\\w ]+', ''), '\\s+', ' ')`.
+    """
+    motto = (motto or "").strip().lower()
+    return WHITESPACE_REGEX.sub(" ", PUNCTUATION_REGEX.sub("", motto))
+
+
+class MottoIndex:
+    """
+    A local index of normalised motto text and message IDs, used to detect duplicate nominations
+    without querying Airtable.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._entries: dict[str, tuple[str, Optional[str]]] = {}
+        self._pks_by_motto: dict[str, set[str]] = {}
+        self._pks_by_message_id: dict[str, set[str]] = {}
+        # Changes made while a full reload is in progress, replayed once it completes
+        self._pending_changes: Optional[list[tuple[str, Optional[dict]]]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, pk: str, motto: Optional[str], message_id: Optional[str]):
+        self._remove(pk)
+        normalised = normalise_motto(motto)
+        message_id = str(message_id) if message_id else None
+        self._entries[pk] = (normalised, message_id)
+        self._pks_by_motto.setdefault(normalised, set()).add(pk)
+        if message_id:
+            self._pks_by_message_id.setdefault(message_id, set()).add(pk)
+
+    def _remove(self, pk: str):
+        if not (entry := self._entries.pop(pk, None)):
+            return
+        normalised, message_id = entry
+        for index, key in (
+            (self._pks_by_motto, normalised),
+            (self._pks_by_message_id, message_id),
+        ):
+            if key is not None and (pks := index.get(key)) is not None:
+                pks.discard(pk)
+                if not pks:
+                    del index[key]
+
+    def add_record(self, record: dict):
+        """
+        Add or replace the entry for an Airtable Motto record.
+        """
+        if self._pending_changes is not None:
+            self._pending_changes.append((record["id"], record))
+        fields = record.get("fields", {})
+        self._add(record["id"], fields.get("Motto"), fields.get("Message ID"))
+
+    def remove(self, pk: str):
+        if self._pending_changes is not None:
+            self._pending_changes.append((pk, None))
+        self._remove(pk)
+
+    def begin_reload(self):
+        self._pending_changes = []
+
+    def abort_reload(self):
+        self._pending_changes = None
+
+    def finish_reload(self, records: Iterable[dict]):
+        """
+        Replace the index contents with the provided Airtable records.
+        Changes recorded since `begin_reload` are reapplied on top, as they may be newer than the records.
+        """
+        pending_changes = self._pending_changes or []
+        self._pending_changes = None
+        self._entries = {}
+        self._pks_by_motto = {}
+        self._pks_by_message_id = {}
+        for record in records:
+            self.add_record(record)
+        for pk, record in pending_changes:
+            if record:
+                self.add_record(record)
+            else:
+                self.remove(pk)
+        self.loaded = True
+
+    def matches(self, motto: str, message_id: Optional[str] = None) -> bool:
+        """
+        Is there a Motto with the same normalised text, or with the provided message ID?
+        """
+        if normalise_motto(motto) in self._pks_by_motto:
+            return True
+        return bool(message_id) and str(message_id) in self._pks_by_message_id
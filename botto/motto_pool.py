@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import random
+import re
+from re import Pattern
+from typing import Iterable, Optional
+
+from models import Motto
+
+log = logging.getLogger("MottoBotto").getChild("motto_pool")
+
+# Searches without any of these characters match the same text as a plain substring search
+REGEX_SPECIAL_CHARACTERS = re.compile(r"[\\.^$*+?{}\[\]|()]")
+
+
+def fingerprint(records: Iterable[dict]) -> str:
+    """
+    A stable hash of Airtable records, used to tell whether a fetched view has changed.
+    """
+    digest = hashlib.sha1()
+    for record in sorted(records, key=lambda r: r["id"]):
+        digest.update(json.dumps(record, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class RandomMottoPool:
+    """
+    An in-memory pool of mottos to choose random mottos from, with members already attached.
+    Plain searches are answered from a trigram index of the lower-cased motto text; only regular
+    expression searches scan the pool.
+    """
+
+    def __init__(self):
+        self.fingerprint: Optional[str] = None
+        self.mottos: list[Motto] = []
+        self._lowered: list[str] = []
+        self._trigrams: dict[str, set[int]] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.fingerprint is not None
+
+    def replace(self, mottos: list[Motto], new_fingerprint: str):
+        lowered = [(m.motto or "").lower() for m in mottos]
+        index = {}
+        for position, text in enumerate(lowered):
+            for trigram in trigrams(text):
+                index.setdefault(trigram, set()).add(position)
+        self.mottos = mottos
+        self._lowered = lowered
+        self._trigrams = index
+        self.fingerprint = new_fingerprint
+
+    def remove(self, pk: str):
+        """
+        Stop choosing a Motto that has been deleted. The index is tidied up on the next refresh.
+        """
+        self.mottos = [m if m.primary_key != pk else None for m in self.mottos]
+
+    def _search(self, search: str) -> Iterable[int]:
+        search = search.lower()
+        search_trigrams = trigrams(search)
+        if not search_trigrams:
+            return (i for i, text in enumerate(self._lowered) if search in text)
+        candidates = set.intersection(
+            *(self._trigrams.get(trigram, set()) for trigram in search_trigrams)
+        )
+        return (i for i in candidates if search in self._lowered[i])
+
+    def choose(
+        self, search: Optional[str] = None, search_regex: Optional[Pattern] = None
+    ) -> Optional[Motto]:
+        if search_regex and REGEX_SPECIAL_CHARACTERS.search(search_regex.pattern):
+            positions = [
+                i for i, m in enumerate(self.mottos) if m and search_regex.search(m.motto)
+            ]
+        elif search := search or (search_regex.pattern if search_regex else None):
+            positions = list(self._search(search))
+        else:
+            positions = range(len(self.mottos))
+        mottos = [self.mottos[i] for i in positions if self.mottos[i]]
+        return random.choice(mottos) if mottos else None
@@ -1,23 +1,104 @@
 import asyncio
 import logging
 import random
+import time
 from collections import AsyncGenerator
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Union, Literal, Callable, Awaitable
+from typing import Optional, Union, Literal, Callable, Awaitable, TypeVar
 
 import aiohttp
 from aiohttp import ClientSession
 from discord import Member as DiscordMember
 
-from models import Motto, Member, AirTableError
+import metrics
+from cache import TTLCache
+from motto_index import MottoIndex
+from motto_pool import RandomMottoPool, fingerprint
+from leaderboard import Leaderboard
+from write_behind import WriteBehindQueue
+from models import (
+    Motto,
+    Member,
+    AirTableError,
+    CircuitOpenError,
+    DeleteFailedError,
+)
 
 log = logging.getLogger(__name__)
 
+RATE_LIMIT_QUEUE_DEPTH = metrics.gauge(
+    "mottobotto_rate_limit_queue_depth",
+    "Requests currently waiting for a rate limit token",
+    labels=["bucket"],
+)
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram(
+    "mottobotto_rate_limit_wait_seconds",
+    "Time spent waiting for a rate limit token",
+    labels=["bucket"],
+)
+AIRTABLE_REQUEST_OUTCOMES = metrics.counter(
+    "mottobotto_airtable_request_outcomes_total",
+    "Airtable requests by final outcome, after any retries",
+    labels=["method", "outcome"],
+)
+AIRTABLE_RETRIES = metrics.counter(
+    "mottobotto_airtable_retries_total",
+    "Airtable request attempts that were retried, by error type",
+    labels=["method", "error_type"],
+)
+AIRTABLE_REQUEST_SECONDS = metrics.histogram(
+    "mottobotto_airtable_request_duration_seconds",
+    "Time taken by each HTTP request to Airtable, by response status",
+    labels=["method", "table", "status"],
+)
+AIRTABLE_CALL_SECONDS = metrics.histogram(
+    "mottobotto_airtable_call_duration_seconds",
+    "Time taken by each Airtable operation, including rate limit waits and retries",
+    labels=["method", "table"],
+)
+AIRTABLE_ATTEMPTS = metrics.histogram(
+    "mottobotto_airtable_call_attempts",
+    "HTTP requests made for each Airtable operation",
+    labels=["method", "table"],
+    buckets=(1, 2, 3, 4, 5, 10),
+)
+AIRTABLE_CIRCUIT_OPEN = metrics.gauge(
+    "mottobotto_airtable_circuit_open",
+    "Whether requests to Airtable are currently being shed (1) or not (0)",
+)
+
 
 def get_name(member: DiscordMember):
     return member.nick if getattr(member, "nick", None) else member.display_name
 
 
+def name_changes(member_record: Member, member: DiscordMember) -> dict:
+    """
+    Return the Member fields that need updating to match the provided Discord Member.
+    """
+    stored_username = member_record.username
+    discord_username = member.name
+
+    update_dict = {}
+    if stored_username != discord_username:
+        update_dict["Username"] = discord_username
+
+    if member_record.use_nickname:
+        stored_nickname = member_record.nickname
+        discord_nickname = get_name(member)
+
+        if (
+            stored_nickname != discord_nickname
+            and discord_nickname != member_record.username
+        ):
+            update_dict["Nickname"] = discord_nickname
+    elif member_record.nickname:
+        update_dict["Nickname"] = ""
+
+    return update_dict
+
+
 class MottoStorage:
     async def save_motto(self, motto: Motto, fields=None):
         """
@@ -103,6 +184,24 @@ class MottoStorage:
     async def remove_unapproved_messages(self, safe_period=24):
         raise NotImplementedError
 
+    async def start(self):
+        """
+        Acquire any resources the storage needs. Called once the event loop is running.
+        """
+        pass
+
+    async def close(self):
+        """
+        Release any resources held by the storage. Safe to call more than once.
+        """
+        pass
+
+    def periodic_jobs(self) -> list[tuple[str, Callable[[], Awaitable[None]], float]]:
+        """
+        Return housekeeping jobs that should be run periodically, as (name, coroutine function, interval in seconds).
+        """
+        return []
+
 
 async def run_request(
     action_to_run: Callable[[ClientSession], Awaitable[dict]],
@@ -115,8 +214,246 @@ async def run_request(
         return await action_to_run(session)
 
 
-async def airtable_sleep():
-    await asyncio.sleep(1.0 / 5)
+async def airtable_error(response: aiohttp.ClientResponse) -> AirTableError:
+    try:
+        response_dict = await response.json(content_type=None)
+    except ValueError:
+        response_dict = None
+    if not isinstance(response_dict, dict) or "error" not in response_dict:
+        # Errors from in front of the API (e.g. load balancers) don't use Airtable's format
+        response_dict = {"error": response.reason or "UNKNOWN_ERROR"}
+    try:
+        retry_after = float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = None
+    return AirTableError(
+        response.url, response_dict, status=response.status, retry_after=retry_after
+    )
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket rate limiter.
+    Up to `burst` requests are let through immediately, after which requests are queued in arrival
+    order and released at `rate` per second. Any one second can therefore see up to `burst + rate - 1`
+    requests, so a `burst` of 1 keeps every second within `rate`.
+    """
+
+    def __init__(self, rate: float, burst: int, name: str):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.queue_depth = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        started_at = time.monotonic()
+        self.queue_depth += 1
+        RATE_LIMIT_QUEUE_DEPTH.set(self.queue_depth, bucket=self.name)
+        try:
+            async with self.lock:
+                self._refill()
+                while self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+        finally:
+            self.queue_depth -= 1
+            RATE_LIMIT_QUEUE_DEPTH.set(self.queue_depth, bucket=self.name)
+        waited = time.monotonic() - started_at
+        RATE_LIMIT_WAIT_SECONDS.observe(waited, bucket=self.name)
+        if waited > 1:
+            log.debug(f"Waited {waited:.2f}s for a {self.name} rate limit token")
+
+    def penalise(self, seconds: float):
+        """
+        Hold back every request for at least `seconds`, e.g. after being told to back off.
+        Penalties overlap rather than add up, so several requests told to back off at once only wait once.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+@dataclass
+class DeleteResult:
+    deleted: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+
+
+class CircuitBreaker:
+    """
+    Sheds requests once `failure_threshold` requests in a row have failed.
+    After `reset_timeout` seconds a single trial request is let through: if it succeeds, requests flow again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        if not self.is_open:
+            return True
+        if self.trial_in_progress or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial_in_progress = True
+        return True
+
+    def record_success(self):
+        if self.is_open:
+            log.info("Airtable requests are succeeding again, closing circuit")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        AIRTABLE_CIRCUIT_OPEN.set(0)
+
+    def abandon_trial(self):
+        """
+        Let another trial request through, as the one in progress ended without telling us anything about Airtable.
+        """
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.is_open or self.failures >= self.failure_threshold:
+            if not self.is_open:
+                log.warning(
+                    f"{self.failures} Airtable requests failed in a row, shedding requests for {self.reset_timeout}s"
+                )
+            self.opened_at = time.monotonic()
+            AIRTABLE_CIRCUIT_OPEN.set(1)
+
+
+T = TypeVar("T")
+
+
+class RetryPolicy:
+    """
+    Retries failed Airtable requests.
+    Rate limited requests are always retried, after the delay Airtable asks for. Server and network errors
+    are retried with jittered exponential back-off, but only for idempotent requests, as a failed
+    non-idempotent request may still have been applied. No retry is started that would take the request
+    past `max_total_delay` seconds.
+    """
+
+    # Airtable asks clients to wait 30 seconds after exceeding the rate limit
+    RATE_LIMIT_DELAY = 30.0
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 10.0,
+        max_total_delay: float = 60.0,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total_delay = max_total_delay
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.rate_limiter = rate_limiter
+
+    @staticmethod
+    def classify(error: Exception) -> str:
+        if isinstance(error, AirTableError):
+            if error.status == 429:
+                return "rate_limited"
+            if error.status and error.status >= 500:
+                return "server_error"
+            return "client_error"
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return "network_error"
+        return "unknown"
+
+    def should_retry(self, error_type: str, idempotent: bool) -> bool:
+        if error_type == "rate_limited":
+            return True
+        return idempotent and error_type in ("server_error", "network_error")
+
+    def delay(self, attempt: int, error: Exception, error_type: str) -> float:
+        if error_type == "rate_limited":
+            return getattr(error, "retry_after", None) or self.RATE_LIMIT_DELAY
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, backoff)
+
+    async def run(
+        self, action: Callable[[], Awaitable[T]], method: str, idempotent: bool
+    ) -> T:
+        attempt = 1
+        started_at = time.monotonic()
+        while True:
+            if not self.circuit_breaker.allow_request():
+                AIRTABLE_REQUEST_OUTCOMES.inc(method=method, outcome="shed")
+                raise CircuitOpenError()
+            try:
+                result = await action()
+            except (AirTableError, aiohttp.ClientError, asyncio.TimeoutError) as error:
+                error_type = self.classify(error)
+                if method == "delete" and attempt > 1 and getattr(error, "status", None) == 404:
+                    # An earlier attempt must have deleted the records after all, but failed before we heard back
+                    self.circuit_breaker.record_success()
+                    AIRTABLE_REQUEST_OUTCOMES.inc(method=method, outcome="success_after_retry")
+                    return None
+                if error_type != "client_error":
+                    self.circuit_breaker.record_failure()
+                else:
+                    # The request reached Airtable and was answered, so the service itself is healthy
+                    self.circuit_breaker.record_success()
+                delay = self.delay(attempt, error, error_type)
+                if (
+                    attempt >= self.max_attempts
+                    or not self.should_retry(error_type, idempotent)
+                    or time.monotonic() - started_at + delay > self.max_total_delay
+                ):
+                    AIRTABLE_REQUEST_OUTCOMES.inc(method=method, outcome=error_type)
+                    raise
+                log.warning(
+                    f"Airtable {method} attempt {attempt} failed ({error_type}: {error}), retrying in {delay:.2f}s"
+                )
+                AIRTABLE_RETRIES.inc(method=method, error_type=error_type)
+                attempt += 1
+                if error_type == "rate_limited" and self.rate_limiter:
+                    # Every request has to back off, so hold back the whole bucket; the retry then waits for a
+                    # token like any other request, rather than waiting twice
+                    self.rate_limiter.penalise(delay)
+                else:
+                    await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.circuit_breaker.abandon_trial()
+                raise
+            except Exception:
+                # e.g. a malformed response; don't retry, but count it against Airtable's health
+                self.circuit_breaker.record_failure()
+                AIRTABLE_REQUEST_OUTCOMES.inc(method=method, outcome="unknown")
+                raise
+            else:
+                self.circuit_breaker.record_success()
+                AIRTABLE_REQUEST_OUTCOMES.inc(
+                    method=method, outcome="success" if attempt == 1 else "success_after_retry"
+                )
+                return result
 
 
 class AirtableMottoStorage(MottoStorage):
@@ -126,18 +463,145 @@ class AirtableMottoStorage(MottoStorage):
         airtable_key: str,
         bot_id: Optional[str],
         random_motto_source_view: str,
+        connection_limit: int = 10,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        rate_limit_per_second: float = 5,
+        rate_limit_burst: int = 1,
+        max_concurrent_requests: int = 5,
+        retry_attempts: int = 4,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 10.0,
+        retry_max_total_delay: float = 60.0,
+        circuit_failure_threshold: int = 5,
+        circuit_reset_seconds: float = 30.0,
+        member_cache_size: int = 1024,
+        member_cache_ttl: float = 3600,
+        motto_index_refresh_minutes: float = 60,
+        random_pool_refresh_minutes: float = 15,
+        leaderboard_refresh_minutes: float = 10,
+        member_write_delay_seconds: float = 2.0,
+        api_url: str = "https://api.airtable.com/v0",
     ):
         self.airtable_key = airtable_key
         self.bot_id = bot_id
-        self.motto_url = "https://api.airtable.com/v0/{base}/Motto".format(
-            base=airtable_base
+        self.motto_url = "{api_url}/{base}/Motto".format(
+            api_url=api_url.rstrip("/"), base=airtable_base
         )
-        self.members_url = "https://api.airtable.com/v0/{base}/Member".format(
-            base=airtable_base
+        self.members_url = "{api_url}/{base}/Member".format(
+            api_url=api_url.rstrip("/"), base=airtable_base
         )
         self.random_motto_source_view = random_motto_source_view
         self.auth_header = {"Authorization": f"Bearer {self.airtable_key}"}
-        self.semaphore = asyncio.Semaphore(5)
+        # Airtable allows 5 requests per second per base
+        self.rate_limiter = TokenBucket(
+            rate_limit_per_second, rate_limit_burst, name="airtable"
+        )
+        # Slow responses would otherwise let requests pile up on the connection pool
+        self.request_slots = asyncio.Semaphore(max_concurrent_requests)
+        self.retry_policy = RetryPolicy(
+            max_attempts=retry_attempts,
+            base_delay=retry_base_delay,
+            max_delay=retry_max_delay,
+            max_total_delay=retry_max_total_delay,
+            circuit_breaker=CircuitBreaker(
+                circuit_failure_threshold, circuit_reset_seconds
+            ),
+            rate_limiter=self.rate_limiter,
+        )
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.session: Optional[ClientSession] = None
+        # Members we've recently read or written, keyed by record ID, plus an index from Discord ID
+        self.members_by_pk = TTLCache(member_cache_size, member_cache_ttl)
+        self.member_pks_by_discord_id = TTLCache(member_cache_size, member_cache_ttl)
+        self.motto_index = MottoIndex()
+        self.motto_index_refresh_minutes = motto_index_refresh_minutes
+        self.random_pool = RandomMottoPool()
+        self.random_pool_refresh_minutes = random_pool_refresh_minutes
+        self._random_pool_lock = asyncio.Lock()
+        self.leaderboard = Leaderboard()
+        self.leaderboard_refresh_minutes = leaderboard_refresh_minutes
+        self.member_updates = WriteBehindQueue(
+            "member", self._update_members, delay=member_write_delay_seconds
+        )
+
+    async def start(self):
+        if self.session and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+        log.info(
+            f"Opened Airtable session (connection limit: {self.connection_limit}, "
+            f"keep-alive: {self.keepalive_timeout}s, DNS cache: {self.dns_cache_ttl}s)"
+        )
+
+    async def close(self):
+        await self.member_updates.close()
+        if self.session and not self.session.closed:
+            await self.session.close()
+            log.info("Closed Airtable session")
+        self.session = None
+
+    def periodic_jobs(self) -> list[tuple[str, Callable[[], Awaitable[None]], float]]:
+        # Periodically reconcile local state with Airtable, to pick up edits made outside the bot
+        return [
+            ("load_motto_index", self.load_motto_index, self.motto_index_refresh_minutes * 60),
+            ("load_random_pool", self.load_random_pool, self.random_pool_refresh_minutes * 60),
+            ("load_leaderboard", self.load_leaderboard, self.leaderboard_refresh_minutes * 60),
+        ]
+
+    def _table_of(self, url: str) -> str:
+        if url.startswith(self.motto_url):
+            return "Motto"
+        if url.startswith(self.members_url):
+            return "Member"
+        return "unknown"
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        action_to_run: Callable[[ClientSession], Awaitable[T]],
+        session: Optional[ClientSession] = None,
+        idempotent: bool = True,
+    ) -> T:
+        table = self._table_of(url)
+        attempts = 0
+
+        async def attempt():
+            nonlocal attempts
+            # Take a slot before a token, so a request isn't held back after its token was granted
+            async with self.request_slots, self.rate_limiter:
+                attempts += 1
+                started_at = time.perf_counter()
+                status = "200"
+                try:
+                    return await run_request(action_to_run, session or self.session)
+                except AirTableError as error:
+                    status = str(error.status or "unknown")
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = "network_error"
+                    raise
+                finally:
+                    AIRTABLE_REQUEST_SECONDS.observe(
+                        time.perf_counter() - started_at, method=method, table=table, status=status
+                    )
+
+        started_at = time.perf_counter()
+        try:
+            return await self.retry_policy.run(attempt, method, idempotent)
+        finally:
+            # Includes time spent waiting for the rate limiter and between retries
+            AIRTABLE_CALL_SECONDS.observe(time.perf_counter() - started_at, method=method, table=table)
+            AIRTABLE_ATTEMPTS.observe(attempts, method=method, table=table)
 
     async def _get(
         self,
@@ -152,15 +616,11 @@ class AirtableMottoStorage(MottoStorage):
                 headers=self.auth_header,
             ) as r:
                 if r.status != 200:
-                    print(r.url)
-                    raise AirTableError(r.url, await r.json())
+                    raise await airtable_error(r)
                 motto_response: dict = await r.json()
                 return motto_response
 
-        async with self.semaphore:
-            result = await run_request(run_fetch, session)
-            await airtable_sleep()
-            return result
+        return await self._send("get", url, run_fetch, session)
 
     async def _list(
         self,
@@ -180,11 +640,20 @@ class AirtableMottoStorage(MottoStorage):
     async def _iterate(
         self,
         base_url: str,
-        filter_by_formula: str,
+        filter_by_formula: Optional[str],
         sort: Optional[list[str]] = None,
         session: Optional[ClientSession] = None,
+        fields: Optional[list[str]] = None,
+        view: Optional[str] = None,
     ) -> AsyncGenerator[dict]:
-        params = {"filterByFormula": filter_by_formula}
+        params = {}
+        if filter_by_formula:
+            params.update({"filterByFormula": filter_by_formula})
+        if view:
+            params.update({"view": view})
+        if fields:
+            for idx, field in enumerate(fields):
+                params.update({"fields[{index}]".format(index=idx): field})
         if sort:
             for idx, field in enumerate(sort):
                 params.update({"sort[{index}][field]".format(index=idx): field})
@@ -193,9 +662,7 @@ class AirtableMottoStorage(MottoStorage):
         while True:
             if offset:
                 params.update(offset=offset)
-            async with self.semaphore:
-                response = await self._get(base_url, params, session)
-                await airtable_sleep()
+            response = await self._get(base_url, params, session)
             records = response.get("records", [])
             for record in records:
                 yield record
@@ -225,12 +692,9 @@ class AirtableMottoStorage(MottoStorage):
             ) as r:
                 if r.status != 200:
                     log.warning(f"Failed to delete IDs: {records_to_delete}")
-                    raise AirTableError(r.url, await r.json())
+                    raise await airtable_error(r)
 
-        async with self.semaphore:
-            result = await run_request(run_delete, session)
-            await airtable_sleep()
-            return result
+        return await self._send("delete", base_url, run_delete, session)
 
     async def _modify(
         self,
@@ -248,14 +712,40 @@ class AirtableMottoStorage(MottoStorage):
                 headers=self.auth_header,
             ) as r:
                 if r.status != 200:
-                    raise AirTableError(r.url, await r.json())
+                    raise await airtable_error(r)
                 motto_response: dict = await r.json()
                 return motto_response
 
-        async with self.semaphore:
-            result = await run_request(run_insert, session)
-            await airtable_sleep()
-            return result
+        return await self._send(
+            method, url, run_insert, session, idempotent=method != "post"
+        )
+
+    async def _modify_records(
+        self,
+        url: str,
+        method: Literal["post", "patch"],
+        records: list[dict],
+        session: Optional[ClientSession] = None,
+    ) -> list[dict]:
+        """
+        Create or update up to 10 records in a single request.
+        """
+
+        async def run_modify(session_to_use: ClientSession):
+            async with session_to_use.request(
+                method,
+                url,
+                json={"records": records},
+                headers=self.auth_header,
+            ) as r:
+                if r.status != 200:
+                    raise await airtable_error(r)
+                return await r.json()
+
+        response = await self._send(
+            method, url, run_modify, session, idempotent=method != "post"
+        )
+        return response.get("records", [])
 
     async def _insert(
         self, url: str, record: dict, session: Optional[ClientSession] = None
@@ -264,8 +754,8 @@ class AirtableMottoStorage(MottoStorage):
 
     async def _update(
         self, url: str, record: dict, session: Optional[ClientSession] = None
-    ):
-        await self._modify(url, "patch", record, session)
+    ) -> dict:
+        return await self._modify(url, "patch", record, session)
 
     async def _list_mottos(
         self,
@@ -283,7 +773,7 @@ class AirtableMottoStorage(MottoStorage):
     def _list_all_members(
         self,
         filter_by_formula: str,
-        sort: [str],
+        sort: Optional[list[str]],
         session: Optional[ClientSession] = None,
     ) -> AsyncGenerator[dict]:
         return self._iterate(self.members_url, filter_by_formula, sort, session)
@@ -302,9 +792,43 @@ class AirtableMottoStorage(MottoStorage):
     ) -> dict:
         return await self._get(f"{self.members_url}/{member_id}", session=session)
 
+    async def _delete_batches(
+        self,
+        base_url: str,
+        record_ids: list[str],
+        session: Optional[ClientSession] = None,
+    ) -> DeleteResult:
+        # AirTable API only allows us to batch delete 10 records at a time, so we need to split up requests.
+        # The batches are sent concurrently, with the rate limiter deciding how many go at once.
+        delete_batches = [
+            record_ids[offset : offset + 10] for offset in range(0, len(record_ids), 10)
+        ]
+
+        async def delete_batch(records_to_delete: list[str]) -> bool:
+            # Each batch is retried by the retry policy
+            try:
+                await self._delete(base_url, records_to_delete, session)
+                return True
+            except (
+                AirTableError,
+                CircuitOpenError,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+            ) as error:
+                log.warning(f"Failed to delete {records_to_delete}: {error}")
+                return False
+
+        results = await asyncio.gather(*(delete_batch(b) for b in delete_batches))
+        result = DeleteResult()
+        for records_to_delete, succeeded in zip(delete_batches, results):
+            (result.deleted if succeeded else result.failed).extend(records_to_delete)
+        if result.failed:
+            log.error(f"Failed to delete IDs: {result.failed}")
+        return result
+
     async def _delete_mottos(
         self, mottos: [Union[str, Motto]], session: aiohttp.ClientSession = None
-    ):
+    ) -> DeleteResult:
         def extract_id(motto_or_id) -> str:
             if type(motto_or_id) is str:
                 return motto_or_id
@@ -314,31 +838,21 @@ class AirtableMottoStorage(MottoStorage):
                 return motto_or_id.primary_key
 
         motto_ids = [extract_id(motto) for motto in mottos]
-        # AirTable API only allows us to batch delete 10 records at a time, so we need to split up requests
-        motto_ids_length = len(motto_ids)
-        delete_batches = (
-            motto_ids[offset : offset + 10] for offset in range(0, motto_ids_length, 10)
-        )
-
-        for records_to_delete in delete_batches:
-            await self._delete(self.motto_url, records_to_delete, session)
+        result = await self._delete_batches(self.motto_url, motto_ids, session)
+        for motto_id in result.deleted:
+            self.motto_index.remove(motto_id)
+            self.random_pool.remove(motto_id)
+        return result
 
     async def _delete_members(
         self, members: [str], session: aiohttp.ClientSession = None
-    ):
-        # AirTable API only allows us to batch delete 10 records at a time, so we need to split up requests
-        member_ids_length = len(members)
-        delete_batches = (
-            members[offset : offset + 10] for offset in range(0, member_ids_length, 10)
-        )
-
-        for records_to_delete in delete_batches:
-            await self._delete(self.motto_url, records_to_delete, session)
+    ) -> DeleteResult:
+        return await self._delete_batches(self.members_url, members, session)
 
     async def insert_motto(
         self, motto_record: dict, session: Optional[ClientSession] = None
-    ):
-        await self._insert(self.motto_url, motto_record, session)
+    ) -> dict:
+        return await self._insert(self.motto_url, motto_record, session)
 
     async def insert_member(
         self, motto_record: dict, session: Optional[ClientSession] = None
@@ -350,16 +864,51 @@ class AirtableMottoStorage(MottoStorage):
         record_id: str,
         motto_record: dict,
         session: Optional[ClientSession] = None,
-    ):
-        await self._update(self.motto_url + "/" + record_id, motto_record, session)
+    ) -> dict:
+        return await self._update(self.motto_url + "/" + record_id, motto_record, session)
 
-    async def update_member(
-        self,
-        record_id: str,
-        motto_record: dict,
-        session: Optional[ClientSession] = None,
+    async def update_member(self, record_id: str, motto_record: dict):
+        """
+        Queue an update to a Member, to be written to Airtable with other updates shortly.
+        Cached copies of the Member reflect the update straight away.
+        """
+        if cached_member := self._cached_member(pk=record_id):
+            cached_member.apply_airtable_fields(motto_record)
+        self.member_updates.update(record_id, motto_record)
+
+    async def _update_members(
+        self, records: list[dict], session: Optional[ClientSession] = None
     ):
-        await self._update(self.members_url + "/" + record_id, motto_record, session)
+        member_records = await self._modify_records(
+            self.members_url, "patch", records, session
+        )
+        for member_record in member_records:
+            member = Member.from_airtable(member_record)
+            # Don't lose any updates queued since this batch was sent
+            member.apply_airtable_fields(
+                self.member_updates.pending.get(member.primary_key, {})
+            )
+            self._cache_member(member)
+
+    def _cache_member(self, member: Member) -> Member:
+        self.members_by_pk.set(member.primary_key, member)
+        if self.leaderboard.loaded:
+            self.leaderboard.refresh_member(member)
+        if member.discord_id:
+            self.member_pks_by_discord_id.set(str(member.discord_id), member.primary_key)
+        return member
+
+    def _cached_member(
+        self, pk: Optional[str] = None, discord_id: Optional[int] = None
+    ) -> Optional[Member]:
+        if discord_id:
+            pk = self.member_pks_by_discord_id.get(str(discord_id))
+        return self.members_by_pk.get(pk) if pk else None
+
+    def _forget_member(self, member: Member):
+        self.members_by_pk.pop(member.primary_key)
+        if member.discord_id:
+            self.member_pks_by_discord_id.pop(str(member.discord_id))
 
     async def save_motto(self, motto: Motto, fields=None):
         fields = fields or [
@@ -374,13 +923,83 @@ class AirtableMottoStorage(MottoStorage):
         motto_data = motto.to_airtable(fields=fields)
         log.info(f"Adding motto data: {motto_data['fields']}")
         if motto.primary_key:
-            await self.update_motto(motto_data["id"], motto_data["fields"])
+            motto_record = await self.update_motto(motto_data["id"], motto_data["fields"])
             log.info(f"Updated Motto from message ID {motto.message_id} in AirTable")
+            if "approved_by_author" in fields and motto.approved_by_author:
+                self.leaderboard.motto_approved(
+                    self._cached_member(pk=motto.member),
+                    self._cached_member(pk=motto.nominated_by),
+                )
         else:
-            await self.insert_motto(motto_data["fields"])
+            motto_record = await self.insert_motto(motto_data["fields"])
+            motto.primary_key = motto_record["id"]
             log.info(f"Added Motto from message ID {motto.message_id} to AirTable")
+        self.motto_index.add_record(motto_record)
+
+    async def load_motto_index(self):
+        """
+        Rebuild the local motto index from every Motto in Airtable.
+        """
+        self.motto_index.begin_reload()
+        try:
+            records = [
+                record
+                async for record in self._iterate(
+                    self.motto_url, None, fields=["Motto", "Message ID"]
+                )
+            ]
+        except Exception:
+            self.motto_index.abort_reload()
+            raise
+        self.motto_index.finish_reload(records)
+        log.info(f"Loaded {len(self.motto_index)} mottos into the local index")
+
+    async def load_random_pool(self, only_if_unloaded: bool = False):
+        """
+        Refresh the pool of mottos that random mottos are chosen from, with their members attached.
+        The pool is only rebuilt if the fetched records have changed.
+        :param only_if_unloaded: Do nothing if the pool has been loaded, e.g. by a call we waited behind
+        """
+        async with self._random_pool_lock:
+            if only_if_unloaded and self.random_pool.loaded:
+                return
+            motto_records = [
+                record
+                async for record in self._iterate(
+                    self.motto_url, None, view=self.random_motto_source_view
+                )
+            ]
+            member_records = [
+                record
+                async for record in self._list_all_members(
+                    filter_by_formula="{Motto Count}>0", sort=None
+                )
+            ]
+            new_fingerprint = fingerprint(motto_records + member_records)
+            if new_fingerprint == self.random_pool.fingerprint:
+                log.debug("Random motto pool is unchanged")
+                return
+
+            members = {
+                record["id"]: self._cache_member(Member.from_airtable(record))
+                for record in member_records
+            }
+            mottos = []
+            for record in motto_records:
+                motto = Motto.from_airtable(record)
+                if not motto.motto or not motto.member:
+                    continue
+                motto.member = members.get(motto.member) or await self.get_member(
+                    pk=motto.member
+                )
+                if motto.member:
+                    mottos.append(motto)
+            self.random_pool.replace(mottos, new_fingerprint)
+            log.info(f"Loaded {len(mottos)} mottos into the random motto pool")
 
     async def get_matching_mottos(self, motto: str, message_id=None) -> bool:
+        if self.motto_index.loaded:
+            return self.motto_index.matches(motto, message_id)
         filter_motto = motto.replace("'", r"\'")
         filter_formula = f"REGEX_REPLACE(REGEX_REPLACE(LOWER(TRIM('{filter_motto}')), '[^\w ]+', ''), '\s+', ' ') = REGEX_REPLACE(REGEX_REPLACE(LOWER(TRIM({{Motto}})), '[^\w ]+', ''), '\s+', ' ')"
         if message_id:
@@ -403,30 +1022,9 @@ class AirtableMottoStorage(MottoStorage):
         return Motto.from_airtable(motto_record[0])
 
     async def get_random_motto(self, search=None, search_regex=None) -> Optional[Motto]:
-
-        filter_func = lambda x: x
-
-        if search_regex:
-            filter_func = lambda x: search_regex.search(x["fields"]["Motto"])
-        elif search:
-            filter_func = lambda x: search.lower() in x["fields"]["Motto"].lower()
-
-        try:
-            motto = Motto.from_airtable(
-                random.choice(
-                    [
-                        m
-                        for m in await self._list_mottos(
-                            filter_by_formula=None, view=self.random_motto_source_view
-                        )
-                        if filter_func(m)
-                    ]
-                )
-            )
-        except IndexError:
-            return
-        motto.member = await self.get_member(pk=motto.member)
-        return motto
+        if not self.random_pool.loaded:
+            await self.load_random_pool(only_if_unloaded=True)
+        return self.random_pool.choose(search=search, search_regex=search_regex)
 
     async def delete_motto(self, pk: str):
         await self._delete_mottos([pk])
@@ -437,6 +1035,8 @@ class AirtableMottoStorage(MottoStorage):
         :param member: The member
         :return: The record from AirTable for this member
         """
+        if cached_member := self._cached_member(discord_id=member.id):
+            return cached_member
         member_record = await self._find_member_by_discord_id(member.id)
         if not member_record:
             data = {
@@ -446,31 +1046,41 @@ class AirtableMottoStorage(MottoStorage):
             }
             member_record = await self.insert_member(data)
             log.debug(f"Added member {member_record} to AirTable")
-        return Member.from_airtable(member_record)
+        return self._cache_member(Member.from_airtable(member_record))
 
     async def get_member(
         self, pk: Optional[str] = None, discord_id: Optional[int] = None
     ) -> Optional[Member]:
+        if not pk and not discord_id:
+            raise TypeError("Must be called with either pk or discord_id.")
+        if cached_member := self._cached_member(pk=pk, discord_id=discord_id):
+            return cached_member
         if pk:
             member_record = await self._retrieve_member(pk)
-        elif discord_id:
-            member_record = await self._find_member_by_discord_id(str(discord_id))
         else:
-            raise TypeError("Must be called with either pk or discord_id.")
-        return Member.from_airtable(member_record) if member_record else None
+            member_record = await self._find_member_by_discord_id(str(discord_id))
+        return self._cache_member(Member.from_airtable(member_record)) if member_record else None
 
     async def remove_all_data(self, discord_id: Optional[int] = None):
-        member_record = await self.get_member(discord_id=discord_id)
-        if member_record:
+        # Always read through to Airtable, as a cached Member's list of mottos may be out of date
+        if airtable_record := await self._find_member_by_discord_id(str(discord_id)):
+            member_record = Member.from_airtable(airtable_record)
+            self._forget_member(member_record)
+            self.member_updates.discard(member_record.primary_key)
+            self.leaderboard.remove_member(member_record.primary_key)
             log.info(
                 f"Removing mottos by {member_record.username}: {member_record.mottos}"
             )
-            async with aiohttp.ClientSession() as session:
-                await self._delete_mottos(member_record.mottos, session)
-                log.info(
-                    f"Removing {member_record.username} ({member_record.primary_key}"
-                )
-                await self._delete_members([member_record.primary_key], session)
+            motto_result = await self._delete_mottos(member_record.mottos)
+            if motto_result.failed:
+                # Keep the member record, so that the request can be retried
+                raise DeleteFailedError(motto_result.failed)
+            log.info(
+                f"Removing {member_record.username} ({member_record.primary_key}"
+            )
+            member_result = await self._delete_members([member_record.primary_key])
+            if member_result.failed:
+                raise DeleteFailedError(member_result.failed)
 
     async def set_nick_option(self, member: DiscordMember, on=False):
         """
@@ -488,27 +1098,7 @@ class AirtableMottoStorage(MottoStorage):
         await self.update_member(member_record.primary_key, update)
 
     async def update_name(self, member_record: Member, member: DiscordMember):
-
-        airtable_username = member_record.username
-        discord_username = member.name
-
-        update_dict = {}
-        if airtable_username != discord_username:
-            update_dict["Username"] = discord_username
-
-        if member_record.use_nickname:
-            airtable_nickname = member_record.nickname
-            discord_nickname = get_name(member)
-
-            if (
-                airtable_nickname != discord_nickname
-                and discord_nickname != member_record.username
-            ):
-                update_dict["Nickname"] = discord_nickname
-        elif member_record.nickname:
-            update_dict["Nickname"] = ""
-
-        if update_dict:
+        if update_dict := name_changes(member_record, member):
             log.debug(f"Recorded changes {update_dict}")
             await self.update_member(member_record.primary_key, update_dict)
 
@@ -533,47 +1123,52 @@ class AirtableMottoStorage(MottoStorage):
         )
         return [Member.from_airtable(x) async for x in members_iterator]
 
-    async def get_leaders(self, count=10) -> list:
+    async def load_leaderboard(self):
+        """
+        Replace the in-memory leaderboard with the current standings from Airtable.
+        """
         members_iterator = self._list_all_members(
             sort=["Total Points"], filter_by_formula="{Motto Count}>0"
         )
-        leaders = []
-        leaders_fetched = 0
-        async for leader in members_iterator:
-            leaders.append(Member.from_airtable(leader))
-            leaders_fetched += 1
-            if leaders_fetched >= count:
-                break
-        return leaders
+        self.leaderboard.replace(
+            [self._cache_member(Member.from_airtable(x)) async for x in members_iterator]
+        )
+        log.info(f"Loaded {len(self.leaderboard.members)} members into the leaderboard")
+
+    async def get_leaders(self, count=10) -> list:
+        if not self.leaderboard.loaded:
+            await self.load_leaderboard()
+        return self.leaderboard.top(count)
 
     async def remove_unapproved_messages(self, safe_period=24):
-        async with aiohttp.ClientSession() as session:
+        motto_expiry_date = datetime.now(timezone.utc) - timedelta(hours=safe_period)
+        filter_formula = "AND(NOT({{Motto}}), IS_BEFORE({{Date}}, DATETIME_PARSE('{expiry}')))".format(
+            expiry=motto_expiry_date.isoformat()
+        )
+        # Airtable's paging cursor isn't documented to survive records being deleted from under it, so each pass
+        # lists every expired motto before deleting any, and passes repeat until one finds nothing left to delete
+        deleted_count = 0
+        failed = set()
+        while True:
             mottos_to_delete = []
-            fetched_mottos = await self._list_mottos(
-                filter_by_formula="NOT({Motto})", session=session
-            )
-            for motto in fetched_mottos:
-                motto_date = datetime.strptime(
-                    motto["fields"]["Date"], "%Y-%m-%dT%H:%M:%S.%f%z"
-                )
-                motto_expiry_date = datetime.now(timezone.utc) - timedelta(
-                    hours=safe_period
-                )
-                if motto_date < motto_expiry_date:
-                    log.debug(
-                        f'Deleting motto {motto["id"]} - message ID {motto["fields"]["Message ID"]}'
-                    )
-                    mottos_to_delete.append(motto)
-
-            if len(mottos_to_delete) > 0:
+            async for motto in self._iterate(
+                self.motto_url, filter_formula, fields=["Message ID"]
+            ):
+                if motto["id"] in failed:
+                    continue
                 log.debug(
-                    "Deleting {motto_count} unapproved mottos".format(
-                        motto_count=len(mottos_to_delete)
-                    )
+                    f'Deleting motto {motto["id"]} - message ID {motto["fields"].get("Message ID")}'
                 )
-                await self._delete_mottos(mottos_to_delete, session)
-                log.info(
-                    "Deleted {motto_count} unapproved mottos".format(
-                        motto_count=len(mottos_to_delete)
-                    )
+                mottos_to_delete.append(motto["id"])
+            if not mottos_to_delete:
+                break
+            result = await self._delete_mottos(mottos_to_delete)
+            deleted_count += len(result.deleted)
+            failed.update(result.failed)
+
+        if deleted_count > 0:
+            log.info(
+                "Deleted {motto_count} unapproved mottos".format(
+                    motto_count=deleted_count
                 )
+            )
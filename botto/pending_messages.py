@@ -0,0 +1,282 @@
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from discord import Message
+from discord.utils import time_snowflake
+
+import metrics
+from sqlite_database import SQLiteDatabase
+
+log = logging.getLogger("MottoBotto").getChild("pending_messages")
+
+PENDING_MESSAGES = metrics.gauge(
+    "mottobotto_pending_messages",
+    "Messages awaiting a reaction that are tracked locally, by kind",
+    labels=["kind"],
+)
+PENDING_MESSAGE_LOOKUPS = metrics.counter(
+    "mottobotto_pending_message_lookups_total",
+    "Reactions checked against the pending message registry, by result",
+    labels=["result"],
+)
+
+NOMINATION = "nomination"
+DELETE_CONFIRMATION = "delete_confirmation"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_messages (
+    message_id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    referenced_message_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    motto_pk TEXT,
+    expires_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS registry_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class PendingMessage:
+    kind: str
+    message_id: int
+    channel_id: int
+    # The nominated message for nominations, or the !delete request for delete confirmations
+    referenced_message_id: int
+    # Whose reaction counts: the nominee for nominations, or whoever asked for their data to be deleted
+    author_id: int
+    motto_pk: Optional[str] = None
+    # Unix time after which an unapproved nomination is removed, or a delete confirmation is forgotten
+    expires_at: Optional[float] = None
+    # Only held for messages seen since startup
+    message: Optional[Message] = None
+    referenced_message: Optional[Message] = None
+    # Set when either message is edited or deleted, so the copies we hold can't be trusted
+    stale: bool = False
+
+    @property
+    def usable(self) -> bool:
+        """
+        Whether the messages we hold can be used instead of fetching them from Discord.
+        """
+        return bool(self.message and self.referenced_message and not self.stale)
+
+
+class PendingMessageStore(SQLiteDatabase):
+    """
+    Keeps pending messages in a SQLite database, so they survive restarts.
+    """
+
+    schema = SCHEMA
+    description = "pending message store"
+    thread_name = "pending_messages"
+
+    async def load(self) -> tuple[list[PendingMessage], Optional[int]]:
+        rows = await self._fetch_all("SELECT * FROM pending_messages ORDER BY message_id")
+        horizon = await self._fetch_one("SELECT value FROM registry_state WHERE key = 'horizon'")
+        return [PendingMessage(**row) for row in rows], int(horizon["value"]) if horizon else None
+
+    async def add(self, pending: PendingMessage):
+        await self._write(
+            lambda connection: connection.execute(
+                "INSERT OR REPLACE INTO pending_messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    pending.message_id,
+                    pending.kind,
+                    pending.channel_id,
+                    pending.referenced_message_id,
+                    pending.author_id,
+                    pending.motto_pk,
+                    pending.expires_at,
+                ),
+            )
+        )
+
+    async def remove(self, *message_ids: int):
+        await self._write(
+            lambda connection: connection.executemany(
+                "DELETE FROM pending_messages WHERE message_id = ?", [(m,) for m in message_ids]
+            )
+        )
+
+    async def set_horizon(self, horizon: int):
+        await self._write(
+            lambda connection: connection.execute(
+                "INSERT OR REPLACE INTO registry_state VALUES ('horizon', ?)", (str(horizon),)
+            )
+        )
+
+
+class PendingMessages:
+    """
+    A bounded registry of the messages MottoBotto is waiting on a reaction to, so reactions to anything else can be
+    ignored without asking Discord about the message.
+
+    Messages are registered as they are sent or reacted to, so the registry only knows about messages from after it
+    was first created, and from after the oldest message it has had to forget. Reactions to older messages can't be
+    ruled out, so `covers` tells the caller when it needs to fetch the message instead.
+
+    With a `path`, the registry is kept on disk and reloaded on startup. Messages loaded from disk are known to be
+    pending, but have to be fetched before they can be used.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 5000,
+        path: Optional[str] = None,
+        nomination_ttl_hours: Optional[float] = None,
+        since: Optional[datetime.datetime] = None,
+        delete_confirmation_ttl_hours: float = 24,
+    ):
+        self.maxsize = maxsize
+        self.nomination_ttl = nomination_ttl_hours * 3600 if nomination_ttl_hours is not None else None
+        self.delete_confirmation_ttl = delete_confirmation_ttl_hours * 3600
+        self.store = PendingMessageStore(path) if path else None
+        self._messages: OrderedDict[int, PendingMessage] = OrderedDict()
+        self._referenced: dict[int, int] = {}
+        # Every message with a later ID was seen while the registry was tracking messages
+        self._horizon = time_snowflake(since or datetime.datetime.utcnow())
+
+    async def start(self):
+        if not self.store:
+            return
+        await self.store.start()
+        loaded, horizon = await self.store.load()
+        if horizon is None:
+            await self.store.set_horizon(self._horizon)
+        else:
+            self._horizon = horizon
+        for pending in loaded:
+            self._track(pending)
+        await self._evict()
+        log.info(f"Loaded {len(loaded)} pending messages")
+
+    async def close(self):
+        if self.store:
+            await self.store.close()
+
+    def _track(self, pending: PendingMessage):
+        if replaced := self._messages.pop(pending.message_id, None):
+            self._forget(replaced)
+        self._messages[pending.message_id] = pending
+        self._referenced[pending.referenced_message_id] = pending.message_id
+        PENDING_MESSAGES.inc(kind=pending.kind)
+
+    def _forget(self, pending: PendingMessage):
+        if self._referenced.get(pending.referenced_message_id) == pending.message_id:
+            del self._referenced[pending.referenced_message_id]
+        PENDING_MESSAGES.dec(kind=pending.kind)
+
+    async def _add(self, pending: PendingMessage):
+        self._track(pending)
+        if self.store:
+            await self.store.add(pending)
+        await self._evict()
+
+    async def _evict(self):
+        evicted = []
+        while len(self._messages) > self.maxsize:
+            message_id, pending = self._messages.popitem(last=False)
+            self._forget(pending)
+            self._horizon = max(self._horizon, message_id)
+            evicted.append(message_id)
+        if evicted:
+            log.debug(f"Forgot {len(evicted)} pending messages, registry now covers messages after {self._horizon}")
+            if self.store:
+                await self.store.remove(*evicted)
+                await self.store.set_horizon(self._horizon)
+
+    async def add_nomination(self, message: Message, motto_message: Message, motto_pk: Optional[str] = None):
+        expires_at = None
+        if self.nomination_ttl is not None:
+            # Unapproved mottos expire relative to when the nominated message was sent
+            created_at = motto_message.created_at.replace(tzinfo=datetime.timezone.utc)
+            expires_at = created_at.timestamp() + self.nomination_ttl
+        await self._add(
+            PendingMessage(
+                kind=NOMINATION,
+                message_id=message.id,
+                channel_id=message.channel.id,
+                referenced_message_id=motto_message.id,
+                author_id=motto_message.author.id,
+                motto_pk=motto_pk,
+                expires_at=expires_at,
+                message=message,
+                referenced_message=motto_message,
+            )
+        )
+
+    async def add_delete_confirmation(self, message: Message, request: Message):
+        await self._add(
+            PendingMessage(
+                kind=DELETE_CONFIRMATION,
+                message_id=message.id,
+                channel_id=message.channel.id,
+                referenced_message_id=request.id,
+                author_id=request.author.id,
+                expires_at=time.time() + self.delete_confirmation_ttl,
+                message=message,
+                referenced_message=request,
+            )
+        )
+
+    def get(self, message_id: int) -> Optional[PendingMessage]:
+        return self._messages.get(message_id)
+
+    async def remove(self, message_id: int):
+        if pending := self._messages.pop(message_id, None):
+            self._forget(pending)
+            if self.store:
+                await self.store.remove(message_id)
+
+    async def expire(self) -> list[PendingMessage]:
+        """
+        Remove and return nominations that have gone unapproved for too long, and delete confirmations that have
+        gone unanswered.
+        """
+        now = time.time()
+        expired = [p for p in self._messages.values() if p.expires_at is not None and p.expires_at < now]
+        for pending in expired:
+            del self._messages[pending.message_id]
+            self._forget(pending)
+        if expired and self.store:
+            await self.store.remove(*(p.message_id for p in expired))
+        return expired
+
+    def covers(self, message_id: int) -> bool:
+        """
+        Whether the registry would know about the message if it was pending.
+        """
+        return message_id > self._horizon
+
+    def covers_since(self, since: datetime.datetime) -> bool:
+        """
+        Whether the registry would know about every pending message sent since `since`.
+        """
+        return time_snowflake(since) > self._horizon
+
+    def message_edited(self, message_id: int):
+        """
+        Mark pending messages that are, or refer to, `message_id` as stale, so they are fetched again when reacted to.
+        """
+        if pending := self._messages.get(message_id):
+            pending.stale = True
+        if (pending_id := self._referenced.get(message_id)) and (pending := self._messages.get(pending_id)):
+            pending.stale = True
+
+    async def message_deleted(self, message_id: int):
+        # A deleted pending message can't be reacted to, but a deleted referenced message still needs handling
+        await self.remove(message_id)
+        self.message_edited(message_id)
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import discord
+from discord import Message
+
+import metrics
+
+log = logging.getLogger("MottoBotto").getChild("reaction_sender")
+
+REACTIONS = metrics.counter(
+    "mottobotto_reactions_total",
+    "Reactions added or removed by the bot, by outcome",
+    labels=["outcome"],
+)
+REACTION_DELAY_SECONDS = metrics.histogram(
+    "mottobotto_reaction_delay_seconds",
+    "How long reactions waited for their channel's rate limit before being sent",
+    buckets=(0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+@dataclass(frozen=True)
+class Reaction:
+    emoji: str
+    # Remove the bot's own reaction instead of adding it
+    remove: bool = False
+
+
+class ReactionSender:
+    """
+    Sends the bot's reactions, paced to Discord's per-channel reaction rate limit so they aren't rejected.
+
+    Each call sends a sequence of reactions for one message. Sequences for the same message are sent in the order
+    they were requested, and within a sequence reactions are sent concurrently unless the order matters (e.g. when
+    spelling out a word). Reactions that are only for fun can be dropped when the channel is too busy to send them
+    promptly, and a reaction already waiting to be sent is never queued twice.
+    """
+
+    def __init__(self, client: discord.Client, rate_per_second: float = 4, max_delay_seconds: float = 10):
+        self.client = client
+        self.interval = 1 / rate_per_second
+        self.max_delay = max_delay_seconds
+        # When the next reaction in each channel may be sent
+        self._next_slot: dict[int, float] = {}
+        self._message_locks: dict[int, asyncio.Lock] = {}
+        self._message_lock_users: dict[int, int] = {}
+        self._queued: set[tuple[int, Reaction]] = set()
+
+    def _delay(self, channel_id: int, count: int = 1) -> float:
+        """
+        How long it would be until `count` more reactions could be sent in `channel_id`.
+        """
+        now = time.monotonic()
+        return max(now, self._next_slot.get(channel_id, now)) - now + (count - 1) * self.interval
+
+    def _reserve_slot(self, channel_id: int, droppable: bool) -> Optional[float]:
+        """
+        Reserve the next slot to react in `channel_id`, returning how long to wait for it, or None if the reaction
+        should be dropped.
+        """
+        delay = self._delay(channel_id)
+        if droppable and delay > self.max_delay:
+            return None
+        now = time.monotonic()
+        if len(self._next_slot) > 1000:
+            self._next_slot = {c: slot for c, slot in self._next_slot.items() if slot > now}
+        self._next_slot[channel_id] = now + delay + self.interval
+        return delay
+
+    async def _send_one(self, message: Message, reaction: Reaction, droppable: bool):
+        delay = self._reserve_slot(message.channel.id, droppable)
+        if delay is None:
+            REACTIONS.inc(outcome="dropped")
+            log.info(f"Dropped {reaction} on message {message.id}, as its channel is too busy")
+            return
+        try:
+            REACTION_DELAY_SECONDS.observe(delay)
+            if delay:
+                await asyncio.sleep(delay)
+            if reaction.remove:
+                await message.remove_reaction(reaction.emoji, self.client.user)
+            else:
+                await message.add_reaction(reaction.emoji)
+            REACTIONS.inc(outcome="sent")
+        except Exception:
+            REACTIONS.inc(outcome="failed")
+            raise
+
+    async def send(
+        self, message: Message, *reactions: Union[str, Reaction], ordered: bool = False, droppable: bool = False
+    ):
+        """
+        Send `reactions` (emoji to add, or `Reaction`s) for `message`, returning once they've all been sent or dropped.
+        `droppable` reactions are dropped if they'd have to wait more than `max_delay_seconds` to be sent.
+        """
+        # Repeating a reaction does nothing on Discord, so only send each once, even if it's already waiting to be sent
+        requested = list(dict.fromkeys(r if isinstance(r, Reaction) else Reaction(r) for r in reactions))
+        reactions = [r for r in requested if (message.id, r) not in self._queued]
+        if len(reactions) < len(requested):
+            REACTIONS.inc(len(requested) - len(reactions), outcome="coalesced")
+        if not reactions:
+            return
+
+        self._queued.update((message.id, r) for r in reactions)
+        lock = self._message_locks.setdefault(message.id, asyncio.Lock())
+        self._message_lock_users[message.id] = self._message_lock_users.get(message.id, 0) + 1
+        try:
+            async with lock:
+                if ordered:
+                    # Dropping part of an ordered sequence would garble it, so it's sent in full or not at all
+                    if droppable and self._delay(message.channel.id, len(reactions)) > self.max_delay:
+                        REACTIONS.inc(len(reactions), outcome="dropped")
+                        log.info(f"Dropped {len(reactions)} reactions on message {message.id}, as its channel is too busy")
+                        return
+                    for reaction in reactions:
+                        await self._send_one(message, reaction, droppable=False)
+                else:
+                    await asyncio.gather(*(self._send_one(message, r, droppable) for r in reactions))
+        except discord.NotFound:
+            log.info(f"Message {message.id} was deleted before it could be reacted to")
+        finally:
+            self._queued.difference_update((message.id, r) for r in reactions)
+            self._message_lock_users[message.id] -= 1
+            if not self._message_lock_users[message.id]:
+                del self._message_lock_users[message.id]
+                del self._message_locks[message.id]
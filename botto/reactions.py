@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import random
 
@@ -6,6 +5,7 @@ from discord import Message
 
 import MottoBotto
 from food import SpecialAction
+from reaction_sender import Reaction
 
 log = logging.getLogger("MottoBotto").getChild("reactions")
 log.setLevel(logging.DEBUG)
@@ -13,121 +13,134 @@ log.setLevel(logging.DEBUG)
 
 async def skynet_prevention(botto: MottoBotto, message: Message):
     log.info(f"{message.author} attempted to activate Skynet!")
-    await message.add_reaction(botto.config["reactions"]["reject"])
-    await message.add_reaction(botto.config["reactions"]["skynet"])
+    await botto.reaction_sender.send(
+        message, botto.config["reactions"]["reject"], botto.config["reactions"]["skynet"]
+    )
     if botto.config["should_reply"]:
         await message.reply("Skynet prevention")
 
 
 async def snail(botto: MottoBotto, message: Message):
     log.info(f"Snail from: {message.author}")
-    await message.add_reaction("🐌")
+    await botto.reaction_sender.send(message, "🐌", droppable=True)
 
 
 async def rate_limit(botto: MottoBotto, message: Message):
     log.info(f"Rate limit response: {message.author}")
-    await message.add_reaction("✋")
+    await botto.reaction_sender.send(message, "✋")
 
 
 async def wave(botto: MottoBotto, message: Message):
     log.info(f"Wave from: {message.author}")
-    await message.add_reaction("👋")
+    await botto.reaction_sender.send(message, "👋", droppable=True)
 
 
 async def shrug(botto: MottoBotto, message: Message):
     log.info(f"Shrug to: {message.author}")
-    await message.add_reaction("🤷")
+    await botto.reaction_sender.send(message, "🤷")
 
 
 async def poke(botto: MottoBotto, message: Message):
     log.info(f"Poke from: {message.author}")
-    await message.add_reaction(random.choice(botto.config["reactions"]["poke"]))
+    await botto.reaction_sender.send(message, random.choice(botto.config["reactions"]["poke"]), droppable=True)
 
 
 async def love(botto: MottoBotto, message: Message):
     log.info(f"Apology/love from: {message.author}")
-    await message.add_reaction(random.choice(botto.config["reactions"]["love"]))
+    await botto.reaction_sender.send(message, random.choice(botto.config["reactions"]["love"]), droppable=True)
 
 
 async def hug(botto: MottoBotto, message: Message):
     log.info(f"Hug from: {message.author}")
-    await message.add_reaction(random.choice(botto.config["reactions"]["hug"]))
+    await botto.reaction_sender.send(message, random.choice(botto.config["reactions"]["hug"]), droppable=True)
 
 
 async def party(botto: MottoBotto, message: Message):
     log.info(f"Party from: {message.author}")
-    tasks = []
-    for _ in range(5):
-        tasks.append(
-            message.add_reaction(random.choice(botto.config["reactions"]["party"]))
-        )
-    await asyncio.wait(tasks)
+    await botto.reaction_sender.send(
+        message, *(random.choice(botto.config["reactions"]["party"]) for _ in range(5)), droppable=True
+    )
 
 
 async def cow(botto: MottoBotto, message: Message):
     log.info(f"Cow from: {message.author}")
-    await message.add_reaction(random.choice(botto.config["reactions"]["cow"]))
+    await botto.reaction_sender.send(message, random.choice(botto.config["reactions"]["cow"]), droppable=True)
 
 
 async def food(botto: MottoBotto, message: Message, food_item: str):
     try:
         reactions = botto.regexes.food.lookup[food_item]
-        for reaction in reactions:
-            if reaction == SpecialAction.echo:
-                await message.add_reaction(food_item)
-            elif reaction == SpecialAction.party:
-                await party(botto, message)
-            else:
-                await message.add_reaction(reaction)
     except KeyError:
         log.error(
             f"Failed to find food item using key {food_item}. "
             f"Message content: '{message.content.encode('unicode_escape')}'",
             exc_info=True,
         )
+        return
+
+    emojis = []
+    for reaction in reactions:
+        if reaction == SpecialAction.echo:
+            emojis.append(food_item)
+        elif reaction == SpecialAction.party:
+            emojis.extend(random.choice(botto.config["reactions"]["party"]) for _ in range(5))
+        else:
+            emojis.append(reaction)
+    await botto.reaction_sender.send(message, *emojis, droppable=True)
 
 
 async def unrecognised_food(botto: MottoBotto, message: Message):
-    await message.add_reaction("😵")
+    await botto.reaction_sender.send(message, "😵", droppable=True)
 
 
 async def not_reply(botto: MottoBotto, message: Message):
     log.info(
         f"Suggestion from {message.author} was not a reply (Message ID {message.id})"
     )
-    await message.add_reaction(botto.config["reactions"]["unknown"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["unknown"])
     if botto.config["should_reply"]:
         await message.reply("I see no motto!")
 
 
 async def fishing(botto: MottoBotto, message: Message):
     log.info(f"Motto fishing from: {message.author}")
-    await message.add_reaction(botto.config["reactions"]["reject"])
-    await message.add_reaction(botto.config["reactions"]["fishing"])
+    await botto.reaction_sender.send(
+        message, botto.config["reactions"]["reject"], botto.config["reactions"]["fishing"]
+    )
 
 
 async def invalid(botto: MottoBotto, message: Message):
     log.info(f"Motto from {message.author} is invalid according to rules.")
-    await message.add_reaction(botto.config["reactions"]["reject"])
-    await message.add_reaction(botto.config["reactions"]["invalid"])
+    await botto.reaction_sender.send(
+        message, botto.config["reactions"]["reject"], botto.config["reactions"]["invalid"]
+    )
 
 
 async def duplicate(botto: MottoBotto, message: Message):
     log.debug("Ignoring motto, it's a duplicate.")
-    await message.add_reaction(botto.config["reactions"]["repeat"])
-    await message.remove_reaction(botto.config["reactions"]["pending"], botto.user)
+    await botto.reaction_sender.send(
+        message, botto.config["reactions"]["repeat"], Reaction(botto.config["reactions"]["pending"], remove=True)
+    )
+    await botto.pending_messages.remove(message.id)
 
 
 async def deleted(botto: MottoBotto, message: Message):
     log.debug("Ignoring motto, it's been deleted.")
-    await message.add_reaction(botto.config["reactions"]["deleted"])
-    await message.add_reaction(botto.config["reactions"]["reject"])
-    await message.remove_reaction(botto.config["reactions"]["pending"], botto.user)
+    await botto.reaction_sender.send(
+        message,
+        botto.config["reactions"]["deleted"],
+        botto.config["reactions"]["reject"],
+        Reaction(botto.config["reactions"]["pending"], remove=True),
+    )
+    # The unapproved motto stays registered as pending, so it's removed from storage when it expires
 
 
 async def stored(botto: MottoBotto, message: Message, motto_message: Message):
-    await message.remove_reaction(botto.config["reactions"]["pending"], botto.user)
-    await message.add_reaction(botto.config["reactions"]["success"])
+    await botto.pending_messages.remove(message.id)
+    reactions = [
+        Reaction(botto.config["reactions"]["pending"], remove=True),
+        botto.config["reactions"]["success"],
+    ]
     if special_reactions := botto.config["special_reactions"].get(
         str(motto_message.author.id)
     ):
@@ -135,7 +148,8 @@ async def stored(botto: MottoBotto, message: Message, motto_message: Message):
         log.info(
             f"Special reaction {chosen_special_reactions} triggered for motto from {motto_message.author.id}"
         )
-        await message.add_reaction(chosen_special_reactions)
+        reactions.append(chosen_special_reactions)
+    await botto.reaction_sender.send(message, *reactions)
     log.debug("Reaction added")
     if botto.config["should_reply"]:
         await message.reply(f'"{motto_message.content}" will be considered!')
@@ -143,46 +157,47 @@ async def stored(botto: MottoBotto, message: Message, motto_message: Message):
 
 
 async def pending(botto: MottoBotto, message: Message, motto_message: Message):
-    await message.add_reaction(botto.config["reactions"]["pending"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["pending"])
     log.debug("Reaction added")
 
 
 async def invalid_emoji(botto: MottoBotto, message: Message):
     log.info(f"Invalid emoji requested from {message.author}")
-    await message.add_reaction(botto.config["reactions"]["invalid_emoji"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["invalid_emoji"])
 
 
 async def valid_emoji(botto: MottoBotto, message: Message):
     log.info(f"Valid emoji requested from {message.author}")
-    await message.add_reaction(botto.config["reactions"]["valid_emoji"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["valid_emoji"])
 
 
 async def rule_1(botto: MottoBotto, message: Message):
-    for emoji in botto.config["reactions"]["rule_1"]:
-        await message.add_reaction(emoji)
+    await botto.reaction_sender.send(message, *botto.config["reactions"]["rule_1"], ordered=True, droppable=True)
     log.info(f"Someone broke rule #1")
 
 
 async def favorite_band(botto: MottoBotto, message: Message):
-    for letter in botto.config["reactions"]["favorite_band"]:
-        await message.add_reaction(letter)
+    # The letters spell out the band's name, so they have to arrive in order
+    await botto.reaction_sender.send(
+        message, *botto.config["reactions"]["favorite_band"], ordered=True, droppable=True
+    )
     log.info(f"Someone asked for favorite band")
 
 
 async def off_topic(botto: MottoBotto, message: Message):
-    await message.add_reaction(random.choice(botto.config["reactions"]["off_topic"]))
+    await botto.reaction_sender.send(message, random.choice(botto.config["reactions"]["off_topic"]), droppable=True)
 
 
 async def unknown_dm(botto: MottoBotto, message: Message):
     log.info(f"I don't know how to handle {message.content} from {message.author}")
-    await message.add_reaction(botto.config["reactions"]["unknown"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["unknown"])
 
 
 async def sleep(botto: MottoBotto, message: Message):
     log.info(f"Sleeping to {message.author}'s message (ID: {message.id})")
-    await message.add_reaction(botto.config["reactions"]["sleep"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["sleep"], droppable=True)
 
 
 async def wave(botto: MottoBotto, message: Message):
     log.info(f"Waving to {message.author}'s message (ID: {message.id})")
-    await message.add_reaction(botto.config["reactions"]["wave"])
+    await botto.reaction_sender.send(message, botto.config["reactions"]["wave"], droppable=True)
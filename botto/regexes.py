@@ -1,10 +1,139 @@
+import logging
 import re
 from dataclasses import dataclass
 from re import Pattern
-from typing import Union
+from typing import Iterable, Optional, Union
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
 
 from food import FoodLookups
 
+log = logging.getLogger("MottoBotto").getChild("regexes")
+
+# Flags that can be scoped to part of a pattern with (?flags:...)
+SCOPED_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s", re.VERBOSE: "x"}
+BACKREFERENCE_REGEX = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _first_characters(items) -> Optional[set]:
+    """
+    The characters a match of the parsed pattern `items` can start with, or None if that can't be worked out
+    cheaply (or the pattern can match an empty string).
+    """
+    for op, av in items:
+        if op is sre_constants.AT:
+            # Zero-width anchors, e.g. ^
+            continue
+        if op is sre_constants.LITERAL:
+            return {chr(av)}
+        if op is sre_constants.IN:
+            characters = set()
+            for item_op, item_av in av:
+                if item_op is sre_constants.LITERAL:
+                    characters.add(chr(item_av))
+                elif item_op is sre_constants.RANGE and item_av[1] - item_av[0] < 256:
+                    characters.update(chr(c) for c in range(item_av[0], item_av[1] + 1))
+                else:
+                    return None
+            return characters
+        if op is sre_constants.SUBPATTERN:
+            return _first_characters(av[-1])
+        if op is sre_constants.BRANCH:
+            characters = set()
+            for branch in av[1]:
+                branch_characters = _first_characters(branch)
+                if branch_characters is None:
+                    return None
+                characters |= branch_characters
+            return characters
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] > 0:
+            return _first_characters(av[2])
+        return None
+    return None
+
+
+def first_characters(pattern: Pattern) -> Optional[frozenset]:
+    try:
+        characters = _first_characters(sre_parse.parse(pattern.pattern, pattern.flags))
+    except (re.error, RecursionError):
+        return None
+    if characters is None:
+        return None
+    # Over-approximate case-insensitive matching, so the set never rules out a possible match
+    return frozenset(characters | {c.lower() for c in characters} | {c.upper() for c in characters})
+
+
+@dataclass
+class TriggerMatch:
+    trigger: Pattern
+    end: int
+
+
+class TriggerDispatcher:
+    """
+    Finds which trigger (if any) a message starts with, checking every trigger in a single regex match.
+    Triggers are tried in order, so the first trigger that matches wins, as with matching them one by one.
+    Messages whose first character can't start any trigger are rejected without running a regex.
+    """
+
+    def __init__(self, triggers: Iterable[Pattern]):
+        self.triggers = list(triggers)
+        self.first_characters: Optional[frozenset] = None
+        self.combined: Optional[Pattern] = None
+        if not self.triggers:
+            self.first_characters = frozenset()
+            return
+
+        trigger_characters = [first_characters(t) for t in self.triggers]
+        if all(c is not None for c in trigger_characters):
+            self.first_characters = frozenset().union(*trigger_characters)
+
+        # Renumbering groups would break backreferences, so those triggers are matched one by one
+        if not any(BACKREFERENCE_REGEX.search(t.pattern) for t in self.triggers):
+            alternatives = "|".join(
+                f"(?P<_trigger{index}>(?{self._scoped_flags(t)}:{t.pattern}))"
+                for index, t in enumerate(self.triggers)
+            )
+            try:
+                self.combined = re.compile(f"(?:{alternatives})")
+            except re.error as error:
+                log.warning(f"Couldn't combine triggers, they will be matched one by one: {error}")
+
+    @staticmethod
+    def _scoped_flags(pattern: Pattern) -> str:
+        return "".join(letter for flag, letter in SCOPED_FLAGS.items() if pattern.flags & flag) or "-x"
+
+    def could_match(self, content: str) -> bool:
+        if self.first_characters is None:
+            return True
+        if not content:
+            return False
+        first = content[0]
+        return (
+            first in self.first_characters
+            or first.lower() in self.first_characters
+            or first.upper() in self.first_characters
+        )
+
+    def match(self, content: str) -> Optional[TriggerMatch]:
+        if not self.could_match(content):
+            return None
+        if self.combined:
+            if match := self.combined.match(content):
+                index = next(
+                    i for i in range(len(self.triggers)) if match.start(f"_trigger{i}") != -1
+                )
+                return TriggerMatch(self.triggers[index], match.end())
+            return None
+        for trigger in self.triggers:
+            if match := trigger.match(content):
+                return TriggerMatch(trigger, match.end())
+        return None
+
 
 @dataclass
 class TagRegexes:
@@ -14,6 +143,7 @@ class TagRegexes:
 @dataclass
 class SuggestionRegexes:
     trigger: [Pattern]
+    triggers: TriggerDispatcher
     tag: Pattern
     pokes: Pattern
     sorry: Pattern
@@ -40,8 +170,14 @@ def compile_regexes(bot_user_id: Union[str, int], config: dict) -> SuggestionReg
 
     line_break_matcher = "[\t\n\r\v]"
 
+    trigger = [re.compile(rf"^{self_id}")]
+    triggers = config["triggers"]["new_motto"]
+    if config["trigger_on_mention"]:
+        triggers = trigger + triggers
+
     regexes = SuggestionRegexes(
-        trigger=[re.compile(rf"^{self_id}")],
+        trigger=trigger,
+        triggers=TriggerDispatcher(triggers),
         tag=re.compile(rf"^{self_id} (.*)"),
         pokes=re.compile(rf"pokes? {self_id}", re.IGNORECASE),
         sorry=re.compile(rf"sorry,? {self_id}", re.IGNORECASE),
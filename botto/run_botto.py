@@ -4,6 +4,8 @@ import logging.config
 
 from MottoBotto import MottoBotto
 from motto_storage import AirtableMottoStorage
+from sqlite_storage import SQLiteMottoStorage
+from hybrid_storage import HybridMottoStorage
 from config import parse
 
 # Configure logging
@@ -33,12 +35,36 @@ except (IOError, OSError, ValueError) as err:
 
 log.info(f"Triggers: {config['triggers']}")
 
-storage = AirtableMottoStorage(
-    config["authentication"]["airtable_base"],
-    config["authentication"]["airtable_key"],
-    config["id"],
-    config["random_source_view"]
-)
+storage_backend = config["storage"]["backend"]
+log.info(f"Storage backend: {storage_backend}")
+
+
+def airtable_storage() -> AirtableMottoStorage:
+    return AirtableMottoStorage(
+        config["authentication"]["airtable_base"],
+        config["authentication"]["airtable_key"],
+        config["id"],
+        config["random_source_view"],
+        **config["airtable"],
+    )
+
+
+if storage_backend == "airtable":
+    storage = airtable_storage()
+elif storage_backend == "sqlite":
+    storage = SQLiteMottoStorage(config["storage"]["sqlite_path"], config["id"])
+elif storage_backend == "hybrid":
+    storage = HybridMottoStorage(
+        config["storage"]["sqlite_path"],
+        config["id"],
+        airtable_storage(),
+        push_interval_seconds=config["storage"]["push_interval_seconds"],
+        pull_interval_minutes=config["storage"]["pull_interval_minutes"],
+        full_pull_interval_minutes=config["storage"]["full_pull_interval_minutes"],
+    )
+else:
+    log.error(f"Unknown storage backend: {storage_backend}")
+    exit(1)
 
 client = MottoBotto(config, storage)
 client.run(config["authentication"]["discord"])
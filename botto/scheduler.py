@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import metrics
+
+log = logging.getLogger("MottoBotto").getChild("scheduler")
+
+JOB_RUNS = metrics.counter(
+    "mottobotto_job_runs_total",
+    "Scheduled job runs, by outcome",
+    labels=["job", "outcome"],
+)
+JOB_DURATION_SECONDS = metrics.histogram(
+    "mottobotto_job_duration_seconds",
+    "How long each scheduled job run took",
+    labels=["job"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[[], Awaitable[None]]
+    interval: float
+    jitter: float = 0.1
+    run_immediately: bool = False
+    running: bool = False
+    last_duration: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def next_delay(self) -> float:
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Scheduler:
+    """
+    Runs housekeeping jobs periodically on the event loop.
+    Each job runs at most once at a time; a run that comes due while the previous run is still going is skipped.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, Job] = {}
+        self.started = False
+
+    def register(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[None]],
+        interval_seconds: float,
+        jitter: float = 0.1,
+        run_immediately: bool = False,
+    ) -> Job:
+        """
+        Register a job to run every `interval_seconds`, give or take `jitter` (a fraction of the interval).
+        """
+        if name in self.jobs:
+            raise ValueError(f"A job named {name!r} is already registered")
+        job = Job(name, func, interval_seconds, jitter, run_immediately)
+        self.jobs[name] = job
+        log.info(f"Registered job {name!r} to run every {interval_seconds:.0f}s")
+        if self.started:
+            job.task = asyncio.create_task(self._loop(job))
+        return job
+
+    async def run_job(self, name: str) -> bool:
+        """
+        Run a job now, unless it is already running.
+        :return: Whether the job ran successfully
+        """
+        job = self.jobs[name]
+        if job.running:
+            log.info(f"Skipping job {name!r}, as it is already running")
+            JOB_RUNS.inc(job=name, outcome="skipped")
+            return False
+
+        job.running = True
+        started_at = time.monotonic()
+        outcome = "failure"
+        try:
+            await job.func()
+            outcome = "success"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            log.error(f"Job {name!r} failed", exc_info=True)
+        finally:
+            job.running = False
+            job.last_duration = time.monotonic() - started_at
+            JOB_DURATION_SECONDS.observe(job.last_duration, job=name)
+            JOB_RUNS.inc(job=name, outcome=outcome)
+            log.info(f"Job {name!r} finished ({outcome}) in {job.last_duration:.2f}s")
+        return outcome == "success"
+
+    async def _loop(self, job: Job):
+        if not job.run_immediately:
+            await asyncio.sleep(job.next_delay())
+        while True:
+            await self.run_job(job.name)
+            await asyncio.sleep(job.next_delay())
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        for job in self.jobs.values():
+            job.task = asyncio.create_task(self._loop(job))
+
+    async def stop(self):
+        self.started = False
+        tasks = [job.task for job in self.jobs.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.task = None
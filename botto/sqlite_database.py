@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+log = logging.getLogger("MottoBotto").getChild("sqlite_database")
+
+T = TypeVar("T")
+
+
+class SQLiteDatabase:
+    """
+    Base for classes that keep their data in a SQLite database.
+    Queries run on a single background thread, so they never block the event loop and never run concurrently.
+    """
+
+    # Run every time the database is opened, so should only create what doesn't exist yet
+    schema = ""
+    # Used in log messages and the name of the background thread
+    description = "SQLite database"
+    thread_name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(self.schema)
+        connection.commit()
+        self.connection = connection
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        if not self.executor:
+            await self.start()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def _fetch_all(self, query: str, params=()) -> list[sqlite3.Row]:
+        return await self._run(
+            lambda: self.connection.execute(query, params).fetchall()
+        )
+
+    async def _fetch_one(self, query: str, params=()) -> Optional[sqlite3.Row]:
+        return await self._run(
+            lambda: self.connection.execute(query, params).fetchone()
+        )
+
+    async def _write(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Run `func` with the connection, inside a transaction.
+        """
+
+        def write():
+            with self.connection:
+                return func(self.connection)
+
+        return await self._run(write)
+
+    async def start(self):
+        if self.executor:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.thread_name)
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._connect)
+        log.info(f"Opened {self.description} at {self.path}")
+
+    async def close(self):
+        if not self.executor:
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.connection.close
+        )
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        self.connection = None
+        log.info(f"Closed {self.description}")
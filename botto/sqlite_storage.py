@@ -0,0 +1,393 @@
+import logging
+import random
+import sqlite3
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from discord import Member as DiscordMember
+
+from motto_index import normalise_motto
+from motto_storage import MottoStorage, name_changes
+from models import Motto, Member
+from sqlite_database import SQLiteDatabase
+
+log = logging.getLogger("MottoBotto").getChild("sqlite_storage")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    id TEXT PRIMARY KEY,
+    discord_id TEXT NOT NULL UNIQUE,
+    username TEXT,
+    nickname TEXT,
+    use_nickname INTEGER NOT NULL DEFAULT 0,
+    emoji TEXT,
+    support INTEGER NOT NULL DEFAULT 0,
+    bot_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS mottos (
+    id TEXT PRIMARY KEY,
+    motto TEXT,
+    normalised_motto TEXT NOT NULL DEFAULT '',
+    message_id TEXT,
+    date TEXT,
+    member_id TEXT REFERENCES members (id) ON DELETE CASCADE,
+    nominated_by_id TEXT REFERENCES members (id) ON DELETE SET NULL,
+    approved_by_author INTEGER NOT NULL DEFAULT 0,
+    approved INTEGER NOT NULL DEFAULT 0,
+    bot_id TEXT
+);
+
+CREATE INDEX IF NOT EXISTS mottos_message_id ON mottos (message_id);
+CREATE INDEX IF NOT EXISTS mottos_normalised_motto ON mottos (normalised_motto);
+CREATE INDEX IF NOT EXISTS mottos_member_id ON mottos (member_id);
+CREATE INDEX IF NOT EXISTS mottos_nominated_by_id ON mottos (nominated_by_id);
+CREATE INDEX IF NOT EXISTS mottos_unapproved_date ON mottos (date) WHERE motto IS NULL OR motto = '';
+
+-- Airtable's "Total Points" is a formula configured in the base; locally points are the motto count
+CREATE VIEW IF NOT EXISTS member_standings AS
+SELECT
+    members.*,
+    (
+        SELECT COUNT(*) FROM mottos
+        WHERE mottos.member_id = members.id AND approved_by_author AND approved
+    ) AS motto_count,
+    (
+        SELECT COUNT(*) FROM mottos
+        WHERE mottos.nominated_by_id = members.id AND approved_by_author AND approved
+    ) AS nominated_motto_count,
+    (
+        SELECT COUNT(*) FROM mottos
+        WHERE mottos.member_id = members.id AND approved_by_author AND approved
+    ) AS total_points
+FROM members;
+"""
+
+# Motto attributes, as used by `Motto.to_airtable`, and the columns they are stored in
+MOTTO_COLUMNS = {
+    "motto": "motto",
+    "message_id": "message_id",
+    "date": "date",
+    "member": "member_id",
+    "nominated_by": "nominated_by_id",
+    "approved_by_author": "approved_by_author",
+    "approved": "approved",
+    "bot_id": "bot_id",
+}
+
+# Member fields, as used in updates, and the columns they are stored in
+MEMBER_COLUMNS = {
+    "Username": "username",
+    "Nickname": "nickname",
+    "Use Nickname": "use_nickname",
+    "Emoji": "emoji",
+}
+
+
+def new_primary_key() -> str:
+    return f"rec{uuid.uuid4().hex}"
+
+
+def format_date(date: Optional[datetime]) -> Optional[str]:
+    if not date:
+        return None
+    # Discord gives us naive UTC datetimes
+    if not date.tzinfo:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def primary_key_of(value) -> Optional[str]:
+    return value.primary_key if isinstance(value, (Member, Motto)) else value
+
+
+def motto_from_row(row: sqlite3.Row) -> Motto:
+    return Motto(
+        primary_key=row["id"],
+        motto=row["motto"],
+        message_id=row["message_id"],
+        date=datetime.fromisoformat(row["date"]) if row["date"] else None,
+        member=row["member_id"],
+        nominated_by=row["nominated_by_id"],
+        approved_by_author=bool(row["approved_by_author"]),
+        approved=bool(row["approved"]),
+        bot_id=row["bot_id"],
+    )
+
+
+def member_from_row(row: sqlite3.Row) -> Member:
+    return Member(
+        primary_key=row["id"],
+        username=row["username"],
+        emoji=row["emoji"],
+        discord_id=row["discord_id"],
+        support=bool(row["support"]),
+        nickname=row["nickname"],
+        use_nickname=bool(row["use_nickname"]),
+        motto_count=row["motto_count"],
+        nominated_motto_count=row["nominated_motto_count"],
+        total_score=row["total_points"],
+        total_points=row["total_points"],
+        bot_id=row["bot_id"],
+        mottos=[],
+    )
+
+
+class SQLiteMottoStorage(SQLiteDatabase, MottoStorage):
+    """
+    Stores mottos in a local SQLite database.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path: str, bot_id: Optional[str]):
+        super().__init__(path)
+        self.bot_id = bot_id
+
+    def _record_change(
+        self,
+        connection: sqlite3.Connection,
+        table: str,
+        operation: str,
+        pk: str,
+        fields: Optional[dict] = None,
+    ):
+        """
+        Called within the transaction of every write made through the storage API, with the Airtable-style
+        fields that were written. Does nothing by default.
+        """
+        pass
+
+    async def save_motto(self, motto: Motto, fields=None):
+        fields = fields or [
+            "motto",
+            "message_id",
+            "member",
+            "date",
+            "nominated_by",
+            "approved",
+            "bot_id",
+        ]
+        values = {}
+        for field in fields:
+            value = getattr(motto, field)
+            if field == "date":
+                value = format_date(value)
+            elif field in ("member", "nominated_by"):
+                value = primary_key_of(value)
+            values[MOTTO_COLUMNS[field]] = value
+        if "motto" in fields:
+            values["normalised_motto"] = normalise_motto(motto.motto)
+        airtable_fields = motto.to_airtable(fields=fields)["fields"]
+        log.info(f"Adding motto data: {values}")
+
+        if motto.primary_key:
+            assignments = ", ".join(f"{column} = ?" for column in values)
+
+            def update(connection: sqlite3.Connection):
+                connection.execute(
+                    f"UPDATE mottos SET {assignments} WHERE id = ?",
+                    (*values.values(), motto.primary_key),
+                )
+                self._record_change(
+                    connection, "mottos", "update", motto.primary_key, airtable_fields
+                )
+
+            await self._write(update)
+            log.info(f"Updated Motto from message ID {motto.message_id}")
+        else:
+            motto.primary_key = new_primary_key()
+            values["id"] = motto.primary_key
+            columns = ", ".join(values)
+            placeholders = ", ".join("?" for _ in values)
+
+            def insert(connection: sqlite3.Connection):
+                connection.execute(
+                    f"INSERT INTO mottos ({columns}) VALUES ({placeholders})",
+                    tuple(values.values()),
+                )
+                self._record_change(
+                    connection, "mottos", "insert", motto.primary_key, airtable_fields
+                )
+
+            await self._write(insert)
+            log.info(f"Added Motto from message ID {motto.message_id}")
+
+    async def get_matching_mottos(self, motto: str, message_id=None) -> bool:
+        row = await self._fetch_one(
+            "SELECT 1 FROM mottos WHERE normalised_motto = ? OR message_id = ? LIMIT 1",
+            (normalise_motto(motto), str(message_id) if message_id else None),
+        )
+        return row is not None
+
+    async def get_motto(self, message_id: str) -> Optional[Motto]:
+        row = await self._fetch_one(
+            "SELECT * FROM mottos WHERE message_id = ?", (str(message_id),)
+        )
+        if not row:
+            log.info(f"Couldn't find matching message in the database.")
+            return
+        return motto_from_row(row)
+
+    async def get_random_motto(self, search=None, search_regex=None) -> Optional[Motto]:
+        query = "SELECT * FROM mottos WHERE approved AND approved_by_author AND motto != ''"
+        if search_regex:
+            candidates = [
+                row
+                for row in await self._fetch_all(query)
+                if search_regex.search(row["motto"])
+            ]
+            row = random.choice(candidates) if candidates else None
+        elif search:
+            row = await self._fetch_one(
+                f"{query} AND instr(lower(motto), ?) ORDER BY RANDOM() LIMIT 1",
+                (search.lower(),),
+            )
+        else:
+            row = await self._fetch_one(f"{query} ORDER BY RANDOM() LIMIT 1")
+        if not row:
+            return
+        motto = motto_from_row(row)
+        motto.member = await self.get_member(pk=motto.member)
+        return motto
+
+    async def delete_motto(self, pk: str):
+        def delete(connection: sqlite3.Connection):
+            if connection.execute("DELETE FROM mottos WHERE id = ?", (pk,)).rowcount:
+                self._record_change(connection, "mottos", "delete", pk)
+
+        await self._write(delete)
+
+    async def get_or_add_member(self, member: DiscordMember) -> Member:
+        def get_or_insert(connection: sqlite3.Connection):
+            pk = new_primary_key()
+            inserted = connection.execute(
+                "INSERT INTO members (id, discord_id, username, bot_id) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (discord_id) DO NOTHING",
+                (pk, str(member.id), member.name, self.bot_id or ""),
+            ).rowcount
+            if inserted:
+                self._record_change(
+                    connection,
+                    "members",
+                    "insert",
+                    pk,
+                    {
+                        "Username": member.name,
+                        "Discord ID": str(member.id),
+                        "Bot ID": self.bot_id or "",
+                    },
+                )
+            return connection.execute(
+                "SELECT * FROM member_standings WHERE discord_id = ?",
+                (str(member.id),),
+            ).fetchone()
+
+        return member_from_row(await self._write(get_or_insert))
+
+    async def get_member(
+        self, pk: Optional[str] = None, discord_id: Optional[int] = None
+    ) -> Optional[Member]:
+        if pk:
+            row = await self._fetch_one(
+                "SELECT * FROM member_standings WHERE id = ?", (pk,)
+            )
+        elif discord_id:
+            row = await self._fetch_one(
+                "SELECT * FROM member_standings WHERE discord_id = ?",
+                (str(discord_id),),
+            )
+        else:
+            raise TypeError("Must be called with either pk or discord_id.")
+        return member_from_row(row) if row else None
+
+    async def remove_all_data(self, discord_id: Optional[int] = None):
+        def remove(connection: sqlite3.Connection) -> int:
+            member_row = connection.execute(
+                "SELECT id FROM members WHERE discord_id = ?", (str(discord_id),)
+            ).fetchone()
+            if not member_row:
+                return 0
+            motto_ids = [
+                row["id"]
+                for row in connection.execute(
+                    "SELECT id FROM mottos WHERE member_id = ?", (member_row["id"],)
+                )
+            ]
+            connection.execute("DELETE FROM mottos WHERE member_id = ?", (member_row["id"],))
+            connection.execute("DELETE FROM members WHERE id = ?", (member_row["id"],))
+            for motto_id in motto_ids:
+                self._record_change(connection, "mottos", "delete", motto_id)
+            self._record_change(connection, "members", "delete", member_row["id"])
+            return len(motto_ids)
+
+        deleted = await self._write(remove)
+        log.info(f"Removed member with Discord ID {discord_id} and {deleted} mottos")
+
+    async def update_member(self, record_id: str, fields: dict):
+        assignments = ", ".join(f"{MEMBER_COLUMNS[field]} = ?" for field in fields)
+
+        def update(connection: sqlite3.Connection):
+            connection.execute(
+                f"UPDATE members SET {assignments} WHERE id = ?",
+                (*fields.values(), record_id),
+            )
+            self._record_change(connection, "members", "update", record_id, fields)
+
+        await self._write(update)
+
+    async def set_nick_option(self, member: DiscordMember, on=False):
+        member_record = await self.get_or_add_member(member)
+        update = {
+            "Use Nickname": on,
+        }
+        if not on:
+            update["Nickname"] = None
+        log.debug(f"Recording changes for {member}: {update}")
+        await self.update_member(member_record.primary_key, update)
+
+    async def update_name(self, member_record: Member, member: DiscordMember):
+        if update_dict := name_changes(member_record, member):
+            log.debug(f"Recorded changes {update_dict}")
+            await self.update_member(member_record.primary_key, update_dict)
+
+    async def update_emoji(self, member_record: Member, emoji: str):
+        if member_record.emoji != emoji:
+            log.debug("Updating member emoji details")
+            await self.update_member(member_record.primary_key, {"Emoji": emoji})
+
+    async def get_support_users(self) -> list:
+        rows = await self._fetch_all(
+            "SELECT * FROM member_standings WHERE support ORDER BY username DESC"
+        )
+        return [member_from_row(row) for row in rows]
+
+    async def get_leaders(self, count=10) -> list:
+        rows = await self._fetch_all(
+            "SELECT * FROM member_standings WHERE motto_count > 0 "
+            "ORDER BY total_points DESC, motto_count DESC, nominated_motto_count DESC "
+            "LIMIT ?",
+            (count,),
+        )
+        return [member_from_row(row) for row in rows]
+
+    async def remove_unapproved_messages(self, safe_period=24):
+        motto_expiry_date = datetime.now(timezone.utc) - timedelta(hours=safe_period)
+
+        def remove(connection: sqlite3.Connection) -> int:
+            expired_ids = [
+                row["id"]
+                for row in connection.execute(
+                    "SELECT id FROM mottos WHERE (motto IS NULL OR motto = '') AND date < ?",
+                    (format_date(motto_expiry_date),),
+                )
+            ]
+            for motto_id in expired_ids:
+                connection.execute("DELETE FROM mottos WHERE id = ?", (motto_id,))
+                self._record_change(connection, "mottos", "delete", motto_id)
+            return len(expired_ids)
+
+        deleted = await self._write(remove)
+        if deleted:
+            log.info(f"Deleted {deleted} unapproved mottos")
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+import metrics
+
+log = logging.getLogger("MottoBotto").getChild("work_queue")
+
+WORK_QUEUE_DEPTH = metrics.gauge(
+    "mottobotto_work_queue_depth",
+    "Jobs waiting for or being run by a work queue worker",
+)
+WORK_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "mottobotto_work_queue_wait_seconds",
+    "How long jobs waited in the work queue before a worker started them",
+)
+WORK_QUEUE_JOBS = metrics.counter(
+    "mottobotto_work_queue_jobs_total",
+    "Jobs run by the work queue, by kind and outcome",
+    labels=["kind", "outcome"],
+)
+
+
+class WorkQueueClosed(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    Runs jobs on a pool of worker tasks, so event handlers can hand off slow work (e.g. storage writes) and return.
+
+    Jobs submitted with the same key run one at a time, in the order they were submitted, so e.g. one user's
+    messages are handled in order, while jobs for different keys run concurrently. At most `max_pending` jobs can
+    be waiting or running at once; past that, submitting waits for space.
+    """
+
+    def __init__(self, workers: int = 8, max_pending: int = 1000):
+        self.worker_count = workers
+        self.max_pending = max_pending
+        self._space: Optional[asyncio.Semaphore] = None
+        # Keys with jobs waiting and no worker running one of their jobs, in the order they became ready
+        self._ready: Optional[asyncio.Queue] = None
+        self._jobs: dict[Hashable, deque] = {}
+        self._pending = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._workers: list[asyncio.Task] = []
+        self.closing = False
+
+    def start(self):
+        if self._workers:
+            return
+        self._space = asyncio.Semaphore(self.max_pending)
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._work(), name=f"worker-{n}") for n in range(self.worker_count)]
+        log.info(f"Started {self.worker_count} workers")
+
+    async def submit(self, key: Hashable, kind: str, func: Callable[[], Awaitable[None]]):
+        """
+        Queue `func` to be run after any jobs already queued for `key`, waiting for space if the queue is full.
+        """
+        if self.closing:
+            raise WorkQueueClosed(f"Can't queue {kind} job, as the work queue is shutting down")
+        self.start()
+        await self._space.acquire()
+        if self.closing:
+            self._space.release()
+            raise WorkQueueClosed(f"Can't queue {kind} job, as the work queue is shutting down")
+        self._pending += 1
+        WORK_QUEUE_DEPTH.set(self._pending)
+        self._idle.clear()
+        jobs = self._jobs.get(key)
+        if jobs is None:
+            jobs = self._jobs[key] = deque()
+            self._ready.put_nowait(key)
+        jobs.append((kind, func, time.monotonic()))
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            jobs = self._jobs[key]
+            kind, func, queued_at = jobs.popleft()
+            WORK_QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+            try:
+                await func()
+                WORK_QUEUE_JOBS.inc(kind=kind, outcome="success")
+            except asyncio.CancelledError:
+                WORK_QUEUE_JOBS.inc(kind=kind, outcome="cancelled")
+                raise
+            except Exception:
+                WORK_QUEUE_JOBS.inc(kind=kind, outcome="error")
+                log.error(f"Failed to run {kind} job for {key}", exc_info=True)
+            finally:
+                # Let another worker pick up this key's next job, behind keys that are already waiting
+                if jobs:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._jobs[key]
+                self._pending -= 1
+                WORK_QUEUE_DEPTH.set(self._pending)
+                self._space.release()
+                if not self._pending:
+                    self._idle.set()
+
+    async def join(self):
+        """
+        Wait until every queued job has finished.
+        """
+        if self._idle:
+            await self._idle.wait()
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        Stop accepting jobs, give queued jobs up to `timeout` seconds to finish, then stop the workers.
+        """
+        self.closing = True
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Gave up waiting for {self._pending} queued jobs after {timeout}s")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        log.info("Stopped work queue")
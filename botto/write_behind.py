@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+import metrics
+from models import AirTableError
+
+log = logging.getLogger("MottoBotto").getChild("write_behind")
+
+WRITE_BEHIND_PENDING = metrics.gauge(
+    "mottobotto_write_behind_pending_records",
+    "Records with updates waiting to be written",
+    labels=["queue"],
+)
+WRITE_BEHIND_FLUSHED = metrics.counter(
+    "mottobotto_write_behind_flushed_records_total",
+    "Records written by write-behind flushes, by outcome",
+    labels=["queue", "outcome"],
+)
+
+
+def is_rejection(error: Exception) -> bool:
+    """
+    Whether Airtable answered a write by rejecting it, rather than failing in a way that's worth retrying.
+    """
+    return (
+        isinstance(error, AirTableError)
+        and bool(error.status)
+        and error.status < 500
+        and error.status != 429
+    )
+
+
+class WriteBehindQueue:
+    """
+    Collects field updates per record and writes them in batches after a short delay.
+    Several updates to the same record within the delay are coalesced into one, with later values winning.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write_batch: Callable[[list[dict]], Awaitable[None]],
+        delay: float = 2.0,
+        batch_size: int = 10,
+    ):
+        self.name = name
+        self.write_batch = write_batch
+        self.delay = delay
+        self.batch_size = batch_size
+        self.pending: dict[str, dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.closed = False
+
+    def update(self, record_id: str, fields: dict):
+        self.pending.setdefault(record_id, {}).update(fields)
+        WRITE_BEHIND_PENDING.set(len(self.pending), queue=self.name)
+        if not self._flush_task and not self.closed:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def discard(self, record_id: str):
+        self.pending.pop(record_id, None)
+        WRITE_BEHIND_PENDING.set(len(self.pending), queue=self.name)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self.pending:
+            return
+        records = [
+            {"id": record_id, "fields": fields}
+            for record_id, fields in self.pending.items()
+        ]
+        self.pending = {}
+        WRITE_BEHIND_PENDING.set(0, queue=self.name)
+        batches = [
+            records[offset : offset + self.batch_size]
+            for offset in range(0, len(records), self.batch_size)
+        ]
+        await asyncio.gather(*(self._write(batch) for batch in batches))
+
+    async def _write(self, batch: list[dict]):
+        try:
+            await self.write_batch(batch)
+        except Exception as error:
+            if not is_rejection(error):
+                log.warning(f"Failed to write {self.name} updates, will retry: {error}")
+                WRITE_BEHIND_FLUSHED.inc(len(batch), queue=self.name, outcome="requeued")
+                for record in batch:
+                    # Keep any newer values that were queued while this batch was being written
+                    self.update(record["id"], {**record["fields"], **self.pending.get(record["id"], {})})
+            elif len(batch) > 1:
+                # Airtable rejects the whole request if any one record is bad, so find out which it was
+                log.warning(
+                    f"Airtable rejected a batch of {len(batch)} {self.name} updates, retrying them one at a time: {error}"
+                )
+                await asyncio.gather(*(self._write([record]) for record in batch))
+            else:
+                # Airtable rejected the update itself, so trying again won't help
+                log.error(f"Dropping rejected {self.name} update {batch[0]}: {error}")
+                WRITE_BEHIND_FLUSHED.inc(queue=self.name, outcome="dropped")
+        else:
+            WRITE_BEHIND_FLUSHED.inc(len(batch), queue=self.name, outcome="written")
+
+    async def close(self):
+        self.closed = True
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self.pending:
+            log.error(f"Lost {self.name} updates that could not be written: {self.pending}")